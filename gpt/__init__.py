@@ -1,4 +1,4 @@
-from .gpt import GPT, run_gpt
+from .gpt import GPT, run_gpt, run_gpt_many
 
 from .evaluate import evaluate_gpt
 from .gpt_distgen import run_gpt_with_distgen, evaluate_gpt_with_distgen
@@ -11,5 +11,6 @@ __all__ = [
     "evaluate_gpt",
     "evaluate_gpt_with_distgen",
     "run_gpt",
+    "run_gpt_many",
     "run_gpt_with_distgen",
 ]
@@ -110,11 +110,11 @@ def read_input_h5(h5):
 #-------------------------------------
 # output read/write
     
-def write_output_h5(h5, gpt_output, name='output'):
+def write_output_h5(h5, gpt_output, name='output', include_stats=False):
     """
     Writes all output to h5 in new group with name. 
     
-    For now, only writes gpt_output['particles']
+    For now, only writes gpt_output['particles'], and the memoized gpt_output['stats'] if include_stats
     """
 
     if('n_tout' not in gpt_output):
@@ -130,6 +130,9 @@ def write_output_h5(h5, gpt_output, name='output'):
     g.attrs['n_tout']=gpt_output['n_tout']
     g.attrs['n_screen']=gpt_output['n_screen']
     write_particles_h5(g, gpt_output['particles'], name='particles')
+
+    if(include_stats and 'stats' in gpt_output):
+        write_stats_h5(g, gpt_output['stats'], name='stats')
     
 
     
@@ -145,7 +148,35 @@ def read_output_h5(h5):
     gpt_output['n_tout'] = h5.attrs['n_tout']
     gpt_output['n_screen'] = h5.attrs['n_screen']
 
+    if('stats' in h5):
+        gpt_output['stats'] = read_stats_h5(h5['stats'])
+
     return gpt_output    
+
+
+def write_stats_h5(h5, stats, name='stats'):
+    """
+    Writes memoized stats, a dict of data_type: {key: array}, as one subgroup per data type 
+    with a dataset per key. Keys that are not valid dataset names (containing '/') are skipped.
+
+    See: read_stats_h5
+    """
+    g = h5.create_group(name)
+
+    for data_type, arrays in stats.items():
+        g2 = g.create_group(data_type)
+        for key, array in arrays.items():
+            if('/' not in key):
+                g2[key] = array
+
+
+def read_stats_h5(h5):
+    """
+    Reads memoized stats from h5
+
+    See: write_stats_h5
+    """
+    return {data_type:{key:h5[data_type][key][()] for key in h5[data_type]} for data_type in h5}
     
     
 def write_particles_h5(h5, particles, name='screen'):
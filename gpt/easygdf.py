@@ -1,17 +1,23 @@
 ################################################################################
 # File: easygdf.py
-# Description: easygdf provides methods that allow the reading of GDF files
-#              directly into python/numpy atomic data types.
+# Description: easygdf provides methods that allow the reading and writing of
+#              GDF files directly to and from python/numpy atomic data types.
 # Author: Christopher M. Pierce (cmp285@cornell.edu)
 ################################################################################
 
 ################################################################################
 # Imports
 ################################################################################
+import collections
+import concurrent.futures
 import io
+import json
+import mmap
 import numpy
+import os
 import pickle
 import struct
+import time
 import unittest
 
 ################################################################################
@@ -21,20 +27,47 @@ import unittest
 GDF_NAME_LEN = 16
 GDF_MAGIC    = 94325877
 
-# The GDF data type magic numbers
-GDF_ASCII     = 1
-GDF_CHAR      = 30
-GDF_DOUBLE    = 3
-GDF_FLOAT     = 90
-GDF_INT16     = 50
-GDF_INT64     = 80
-GDF_LONG      = 2
-GDF_NULL      = 10
-GDF_UCHAR     = 20
-GDF_UINT16    = 40
-GDF_UINT32    = 60
-GDF_UINT64    = 70
-GDF_UNDEFINED = 0
+# The layout of a block header, used to decode many of them at once
+GDF_HEADER_DTYPE = numpy.dtype([('name', 'S16'), ('type', 'i4'), ('size', 'i4')])
+
+# Bumped whenever the layout of the cached table of contents changes
+GDF_INDEX_VERSION = 2
+
+# The arrays used to build the phase space arrays of touts and screens
+TOUT_KEYS   = ['x', 'Bx', 'y', 'By', 'z', 'Bz', 'G']
+SCREEN_KEYS = ['x', 'Bx', 'y', 'By', 'z', 'Bz', 'G', 't']
+
+# The GDF data type magic numbers, the low byte of a block's type flag
+GDF_ASCII     = 0x01
+GDF_CHAR      = 0x30
+GDF_DOUBLE    = 0x03
+GDF_FLOAT     = 0x90
+GDF_INT8      = 0x30
+GDF_INT16     = 0x50
+GDF_INT32     = 0x02
+GDF_INT64     = 0x80
+GDF_LONG      = 0x02
+GDF_NULL      = 0x10
+GDF_UCHAR     = 0x20
+GDF_UINT8     = 0x20
+GDF_UINT16    = 0x40
+GDF_UINT32    = 0x60
+GDF_UINT64    = 0x70
+GDF_UNDEFINED = 0x00
+
+# The NumPy types of the numeric GDF data types
+GDF_NUMPY_TYPES = {
+    GDF_DOUBLE: 'f8',
+    GDF_FLOAT:  'f4',
+    GDF_INT8:   'i1',
+    GDF_INT16:  'i2',
+    GDF_INT32:  'i4',
+    GDF_INT64:  'i8',
+    GDF_UINT8:  'u1',
+    GDF_UINT16: 'u2',
+    GDF_UINT32: 'u4',
+    GDF_UINT64: 'u8',
+}
 
 # The bit masks for the types of GDF blocks
 GDF_DIRECTORY = 256
@@ -42,6 +75,9 @@ GDF_END       = 512
 GDF_SINGLE    = 1024
 GDF_ARRAY     = 2048
 
+# A single tout or screen: its kind ('tout' or 'screen'), time/position and dict of arrays
+GDFBlock = collections.namedtuple('GDFBlock', ['kind', 'value', 'arrays'])
+
 ################################################################################
 # Function Definitions
 ################################################################################
@@ -59,80 +95,61 @@ def is_GDF_file(file):
     return magic_number == GDF_MAGIC
 
 
-def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_block_size=None, tout_block_size=None,
-         extra_tout_keys=[], extra_screen_keys=[]):
-    '''Reads all screens and touts  from the open file object file.  These are returned as a the tuple (touts,
-    screens) where each of touts and screens is a list of numpy arrays of the phase space coordinates.  The output
-    array has the format:
-
-        [[x_0,   x_1,   x_2,   ..., x_(n-1)  ],
-         [BGx_0, BGx_1, BGx_2, ..., BGx_(n-1)],
-         [y_0,   y_1,   y_2,   ..., y_(n-1)  ],
-         [BGy_0, BGy_1, BGy_2, ..., BGy_(n-1)],
-         [z_0,   z_1,   z_2,   ..., z_(n-1)  ],
-         [BGz_0, BGz_1, BGz_2, ..., BGz_(n-1)],
-         [t_0,   t_1,   t_2,   ..., t_(n-1)  ]]
-
-    The spatial coordinates have units of meters and BGx, BGy, BGz refer to the components of the normalized
-    relativistic momentum Beta*Gamma and are unitless.  Here, time has units of seconds and charge has units of
-    Coulombs.
+def iter_blocks(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_block_size=None,
+                tout_block_size=None, columns=None, use_mmap=False, index=None, compact=False):
+    '''Reads the screens and touts from the open file object file one at a time.  This is a generator that yields a
+    `GDFBlock` record for each tout and screen in file order.  Its fields are `kind` ('tout' or 'screen'), `value`
+    (the time of the tout or the position of the screen) and `arrays`, a dict of the block's numeric arrays keyed by
+    their names in the GDF file.  Only the block being yielded is held in memory, so whole runs can be reduced to
+    statistics with bounded memory.  `load` and `load_dict` are built on this function.
 
-    The touts and screens can be filtered by time and position.  The inputs `tout_filter` and `screen_filter` accept
-    lambdas of one parameter.  That parameter is time/position and the lambda should return true or false indicating
-    whether to read that screen or not.  Although this does speed up load times and reduces memory overhead in most
-    cases, some large files can take a long time to load even a single screen or tout.  This is because the way the
-    GDF file is formatted requires the parser to read every block (including variables in the touts and screens) once
-    while going through the file.  To get around this, you can try specifying `screen_block_size` and
-    `tout_block_size`.  These tell the parser how large a tout or screen is in bytes and causes it to skip over them
-    instead of reading the header of each variable.  This can improve performance by an order of magnitude on some
-    files.  Be careful however, since incorrectly setting the block size will cause the parser to load corrupted
-    data.
-
-    The `extra_tout_keys` and `extra_screen_keys` parameters are used to load addition particle variables such as
-    scatter variables or field values at the particle locations.  It is a list of strings where each string is the
-    key to be loaded.  The key should match up with the name of the variable as written to the GDF file.  The
-    variables will be appended to the numpy array as rows in the order they appear in the list.
+    The filters, the block size hints, `use_mmap`, `index` and `compact` behave as described in `load_dict`.  The `columns`
+    parameter is a list of the array names to read from each block, or a dict of such lists with the keys 'tout' and
+    'screen'.  By default every array is read.  The file must not be used for anything else while iterating.
 
     Example Usage:
 
     # Load the EasyGDF module
     import easygdf
 
-    # Open a GDF file
+    # Open a GDF file and find the largest beam size
     with open('output.gdf', 'rb') as f:
-      touts, screens = easygdf.load(f)
+      sigma_x = max(block.arrays['x'].std() for block in easygdf.iter_blocks(f, columns=['x']))
     '''
+    # Check the file
+    _check_file(file)
 
-    # Check if the file is a real file object
-    if (not isinstance(file, io.IOBase)):
-        raise TypeError('Argument is not a file-like object')
+    # Map the file into memory if requested
+    buffer = _get_buffer(file, use_mmap)
 
-    # If the file wasn't opened in binary mode
-    if 'b' not in file.mode:
-        # Raise an exception
-        raise ValueError("File is not in binary mode.  "
-                         "Try opening with option 'rb'")
+    # Use the same columns for both kinds of block unless told otherwise
+    if not isinstance(columns, dict):
+        columns = {'tout': columns, 'screen': columns}
 
-    # Check if the file is readable
-    try:
-        file.read(1)
+    # Without block size hints, find the blocks with a bulk decode of the headers
+    if (index is None) and (screen_block_size is None) and (tout_block_size is None):
+        index = build_index(file)
 
-    except IOError:
-        raise ValueError('Could not read from file')
+    # If we have a table of contents, go straight to the blocks we want
+    if (index is not None):
+        # For each block that passes the filters
+        for block in _filter_index(index, tout_filter, screen_filter):
+            # Pick the arrays we were asked for
+            keys = columns[block['kind']]
+            if keys is not None:
+                keys = [key for key in block['arrays'] if key in keys]
 
-    # Check it against the real magic number
-    if (not is_GDF_file(file)):
-        raise ValueError('File is not GDF formatted')
+            # Read them
+            yield GDFBlock(block['kind'], block['value'], _read_block(file, buffer, block, keys, compact))
+
+        # We are done
+        return
 
     # Jump to where the data actually begins
     file.seek(48)
 
     # Make a variable to keep track of state
     state = 'root'
-
-    # Make holders for our phase space variables
-    touts = []
-    screens = []
     block_value = None
 
     # Make storage for the values we will use
@@ -146,47 +163,9 @@ def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_
 
         # If no data came back
         if block_header == b'':
-            # If we were in a tout
-            if (state == 'tout'):
-                # Get the array
-                phase_space_array = numpy.array([
-                    screen_tout_arrays['x'],
-                    screen_tout_arrays['Bx'] * screen_tout_arrays['G'],
-                    screen_tout_arrays['y'],
-                    screen_tout_arrays['By'] * screen_tout_arrays['G'],
-                    screen_tout_arrays['z'],
-                    screen_tout_arrays['Bz'] * screen_tout_arrays['G'],
-                    numpy.ones(screen_tout_arrays['x'].shape[0]) * block_value,
-                ])
-
-                # For each extra one
-                for key in extra_tout_keys:
-                    # Append it
-                    phase_space_array = numpy.append(phase_space_array, [screen_tout_arrays[key]], axis=0)
-
-                # Append it to the list
-                touts.append(phase_space_array)
-
-            # Or, if we were in a screen
-            elif (state == 'screen'):
-                # Create the phase space array
-                phase_space_array = numpy.array([
-                    screen_tout_arrays['x'],
-                    screen_tout_arrays['Bx'] * screen_tout_arrays['G'],
-                    screen_tout_arrays['y'],
-                    screen_tout_arrays['By'] * screen_tout_arrays['G'],
-                    screen_tout_arrays['z'],
-                    screen_tout_arrays['Bz'] * screen_tout_arrays['G'],
-                    screen_tout_arrays['t'],
-                ])
-
-                # For each extra one
-                for key in extra_screen_keys:
-                    # Append it
-                    phase_space_array = numpy.append(phase_space_array, [screen_tout_arrays[key]], axis=0)
-
-                # Append it to the list
-                screens.append(phase_space_array)
+            # If we were in a tout or a screen, hand it out
+            if (state == 'tout') or (state == 'screen'):
+                yield GDFBlock(state, block_value, screen_tout_arrays)
 
             # End the loop
             break
@@ -257,14 +236,11 @@ def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_
             elif ((state == 'tout') or (state == 'screen')):
                 # If it's an array object
                 if (array):
-                    # Get the data-type
-                    data_type = get_data_type(block_type_flag & 255)
-
-                    # If it's a double
-                    if (data_type == 'double'):
+                    # If it's a number we were asked for
+                    if _is_numeric(block_type_flag) and ((columns[state] is None) or (block_name in columns[state])):
                         # Get the array
-                        screen_tout_arrays[block_name] = numpy.fromfile(file, dtype=numpy.dtype('d'),
-                                                                        count=block_size // 8)
+                        screen_tout_arrays[block_name] = _read_typed_array(file, buffer, block_type_flag, block_size,
+                                                                           compact)
 
                     # Otherwise
                     else:
@@ -273,45 +249,8 @@ def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_
 
                 # If it's time to end the block
                 elif (end):
-                    if (state == 'tout'):
-                        # Get the array
-                        phase_space_array = numpy.array([
-                            screen_tout_arrays['x'],
-                            screen_tout_arrays['Bx'] * screen_tout_arrays['G'],
-                            screen_tout_arrays['y'],
-                            screen_tout_arrays['By'] * screen_tout_arrays['G'],
-                            screen_tout_arrays['z'],
-                            screen_tout_arrays['Bz'] * screen_tout_arrays['G'],
-                            numpy.ones(screen_tout_arrays['x'].shape[0]) * block_value,
-                        ])
-
-                        # For each extra one
-                        for key in extra_tout_keys:
-                            # Append it
-                            phase_space_array = numpy.append(phase_space_array, [screen_tout_arrays[key]], axis=0)
-
-                        # Append it to the list
-                        touts.append(phase_space_array)
-
-                    elif (state == 'screen'):
-                        # Create the phase space array
-                        phase_space_array = numpy.array([
-                            screen_tout_arrays['x'],
-                            screen_tout_arrays['Bx'] * screen_tout_arrays['G'],
-                            screen_tout_arrays['y'],
-                            screen_tout_arrays['By'] * screen_tout_arrays['G'],
-                            screen_tout_arrays['z'],
-                            screen_tout_arrays['Bz'] * screen_tout_arrays['G'],
-                            screen_tout_arrays['t'],
-                        ])
-
-                        # For each extra one
-                        for key in extra_screen_keys:
-                            # Append it
-                            phase_space_array = numpy.append(phase_space_array, [screen_tout_arrays[key]], axis=0)
-
-                        # Append it to the list
-                        screens.append(phase_space_array)
+                    # Hand out the finished block
+                    yield GDFBlock(state, block_value, screen_tout_arrays)
 
                     # Change the state back
                     state = 'root'
@@ -321,16 +260,30 @@ def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_
                     # Skip ahead
                     file.seek(block_size, 1)
 
-    # Return everything
-    return (touts, screens)
 
+def make_phase_space_array(block, extra_keys=[]):
+    '''Returns the phase space array described in `load` for a `GDFBlock` yielded by `iter_blocks`, with the arrays
+    named in `extra_keys` appended as rows.'''
+    return _make_phase_space_array(block.kind, block.arrays, block.value, extra_keys)
 
-def load_dict(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_block_size=None,
-              tout_block_size=None):
-    '''Reads all screens and touts  from the open file object file.  These are returned as python dictionaries where
-    the keys to the dict are the keys to the arrays in the GDF file itself.  The spatial coordinates have units of
-    meters and BGx, BGy, BGz refer to the components of the normalized relativistic momentum Beta*Gamma and are
-    unitless.  Here, time has units of seconds and charge has units of Coulombs.
+
+def load(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_block_size=None, tout_block_size=None,
+         extra_tout_keys=[], extra_screen_keys=[], use_mmap=False, index=None):
+    '''Reads all screens and touts  from the open file object file.  These are returned as a the tuple (touts,
+    screens) where each of touts and screens is a list of numpy arrays of the phase space coordinates.  The output
+    array has the format:
+
+        [[x_0,   x_1,   x_2,   ..., x_(n-1)  ],
+         [BGx_0, BGx_1, BGx_2, ..., BGx_(n-1)],
+         [y_0,   y_1,   y_2,   ..., y_(n-1)  ],
+         [BGy_0, BGy_1, BGy_2, ..., BGy_(n-1)],
+         [z_0,   z_1,   z_2,   ..., z_(n-1)  ],
+         [BGz_0, BGz_1, BGz_2, ..., BGz_(n-1)],
+         [t_0,   t_1,   t_2,   ..., t_(n-1)  ]]
+
+    The spatial coordinates have units of meters and BGx, BGy, BGz refer to the components of the normalized
+    relativistic momentum Beta*Gamma and are unitless.  Here, time has units of seconds and charge has units of
+    Coulombs.
 
     The touts and screens can be filtered by time and position.  The inputs `tout_filter` and `screen_filter` accept
     lambdas of one parameter.  That parameter is time/position and the lambda should return true or false indicating
@@ -346,7 +299,18 @@ def load_dict(file, tout_filter=lambda x: True, screen_filter=lambda x: True, sc
     The `extra_tout_keys` and `extra_screen_keys` parameters are used to load addition particle variables such as
     scatter variables or field values at the particle locations.  It is a list of strings where each string is the
     key to be loaded.  The key should match up with the name of the variable as written to the GDF file.  The
-    variables will be appended to the numpy array as rows in the order they appear in the list.
+    variables will be appended to the numpy array as rows in the order they appear in the list.  Only the arrays
+    needed for the phase space array and these extra keys are read; every other array in a tout or screen is skipped
+    over.
+
+    Setting `use_mmap` memory-maps the file instead of copying each variable out of it with `numpy.fromfile`.  The
+    particle variables are then read-only views into the mapping and only the phase space arrays themselves are
+    allocated, which keeps the memory overhead of loading large files close to the size of the returned data.
+
+    Instead of walking the file, the touts and screens can be read straight from a table of contents made by
+    `build_index` or `load_index` by passing it as `index`.  Only the blocks accepted by the filters are visited and
+    each of their variables is found with a single seek, so this is the safe replacement for `screen_block_size` and
+    `tout_block_size`.
 
     Example Usage:
 
@@ -358,159 +322,89 @@ def load_dict(file, tout_filter=lambda x: True, screen_filter=lambda x: True, sc
       touts, screens = easygdf.load(f)
     '''
 
-    # Check if the file is a real file object
-    if (not isinstance(file, io.IOBase)):
-        raise TypeError('Argument is not a file-like object')
-
-    # If the file wasn't opened in binary mode
-    if 'b' not in file.mode:
-        # Raise an exception
-        raise ValueError("File is not in binary mode.  "
-                         "Try opening with option 'rb'")
-
-    # Check if the file is readable
-    try:
-        file.read(1)
-
-    except IOError:
-        raise ValueError('Could not read from file')
-
-    # Check it against the real magic number
-    if (not is_GDF_file(file)):
-        raise ValueError('File is not GDF formatted')
-
-    # Jump to where the data actually begins
-    file.seek(48)
-
-    # Make a variable to keep track of state
-    state = 'root'
-
     # Make holders for our phase space variables
     touts = []
     screens = []
-    block_value = None
-
-    # Make storage for the values we will use
-    screen_tout_arrays = {}
-    first_tout = True
-
-    # Go into an infinite loop
-    while True:
-        # Read the block's header
-        block_header = file.read(16 + 4 + 4)
-
-        # If no data came back
-        if block_header == b'':
-            # If we were in a tout
-            if (state == 'tout'):
-                # Append it to the list
-                touts.append(screen_tout_arrays)
 
-            # Or, if we were in a screen
-            elif (state == 'screen'):
-                # Append it to the list
-                screens.append(screen_tout_arrays)
-
-            # End the loop
-            break
+    # Only the arrays that end up in the phase space arrays are read, the rest are skipped
+    columns = {'tout': TOUT_KEYS + list(extra_tout_keys), 'screen': SCREEN_KEYS + list(extra_screen_keys)}
 
+    # For each tout and screen in the file
+    for block in iter_blocks(file, tout_filter=tout_filter, screen_filter=screen_filter,
+                             screen_block_size=screen_block_size, tout_block_size=tout_block_size, columns=columns,
+                             use_mmap=use_mmap, index=index):
+        # Append its phase space array to the right list
+        if (block.kind == 'tout'):
+            touts.append(make_phase_space_array(block, extra_tout_keys))
         else:
-            # Clean up the name
-            block_name = block_header[0:16]
-            block_name = block_name.split(b'\0', 1)[0]
-            block_name = block_name.decode('utf8')
+            screens.append(make_phase_space_array(block, extra_screen_keys))
 
-            # Get the block's type_flag and size
-            block_type_flag, = struct.unpack('i', block_header[16:20])
-            block_size, = struct.unpack('i', block_header[20:24])
-
-            # Break up the type flag into its parts
-            directory = bool(block_type_flag & GDF_DIRECTORY)
-            end = bool(block_type_flag & GDF_END)
-            single = bool(block_type_flag & GDF_SINGLE)
-            array = bool(block_type_flag & GDF_ARRAY)
-
-            # If we are in the root state
-            if (state == 'root'):
-                # If we are the start of a tout block
-                if (block_name == 'time'):
-                    # Get the value of it
-                    block_value, = struct.unpack('d', file.read(8))
-
-                    # If the filter says that we will load it
-                    if (tout_filter(block_value)):
-                        # We are now in the tout state
-                        state = 'tout'
+    # Return everything
+    return (touts, screens)
 
-                        # Clean out the array dict
-                        screen_tout_arrays = {}
-                    else:
-                        # If we are given the number of particles and elements in a tout
-                        if ((tout_block_size is not None) and not first_tout):
-                            # Try to skip by the correct amount
-                            file.seek(tout_block_size, 1)
 
-                    # We are no longer the first tout
-                    first_tout = False
+def load_dict(file, tout_filter=lambda x: True, screen_filter=lambda x: True, screen_block_size=None,
+              tout_block_size=None, use_mmap=False, index=None, columns=None, compact=False):
+    '''Reads all screens and touts  from the open file object file.  These are returned as python dictionaries where
+    the keys to the dict are the keys to the arrays in the GDF file itself.  The spatial coordinates have units of
+    meters and BGx, BGy, BGz refer to the components of the normalized relativistic momentum Beta*Gamma and are
+    unitless.  Here, time has units of seconds and charge has units of Coulombs.
 
-                # If we are the start of a screen
-                elif (block_name == 'position'):
-                    # Get the value of it
-                    block_value, = struct.unpack('d', file.read(8))
+    The touts and screens can be filtered by time and position.  The inputs `tout_filter` and `screen_filter` accept
+    lambdas of one parameter.  That parameter is time/position and the lambda should return true or false indicating
+    whether to read that screen or not.  Although this does speed up load times and reduces memory overhead in most
+    cases, some large files can take a long time to load even a single screen or tout.  This is because the way the
+    GDF file is formatted requires the parser to read every block (including variables in the touts and screens) once
+    while going through the file.  To get around this, you can try specifying `screen_block_size` and
+    `tout_block_size`.  These tell the parser how large a tout or screen is in bytes and causes it to skip over them
+    instead of reading the header of each variable.  This can improve performance by an order of magnitude on some
+    files.  Be careful however, since incorrectly setting the block size will cause the parser to load corrupted
+    data.
 
-                    # If the filter says that we will load it
-                    if (screen_filter(block_value)):
-                        # We are now in the screen state
-                        state = 'screen'
+    The `extra_tout_keys` and `extra_screen_keys` parameters are used to load addition particle variables such as
+    scatter variables or field values at the particle locations.  It is a list of strings where each string is the
+    key to be loaded.  The key should match up with the name of the variable as written to the GDF file.  The
+    variables will be appended to the numpy array as rows in the order they appear in the list.
 
-                        # Clean out the array dict
-                        screen_tout_arrays = {}
-                    else:
-                        # If we are given the number of particles and elements in a tout
-                        if (screen_block_size is not None):
-                            # Try to skip by the correct amount
-                            file.seek(screen_block_size, 1)
+    Setting `use_mmap` memory-maps the file instead of copying each variable out of it with `numpy.fromfile`.  The
+    arrays in the returned dicts are then read-only views into the mapping, so no particle data is copied at all.
+    The mapping is released once the last of these arrays is garbage collected.
 
-                # If it's just some random block
-                else:
-                    # Move us to the next block
-                    file.seek(block_size, 1)
+    The `columns` parameter is a list of the array names to read from each tout and screen.  All other arrays are
+    skipped over without being read.  By default every array in the file is read.
 
-            # If we are in the tout state
-            elif ((state == 'tout') or (state == 'screen')):
-                # If it's an array object
-                if (array):
-                    # Get the data-type
-                    data_type = get_data_type(block_type_flag & 255)
+    Arrays of every numeric GDF type (see `GDF_NUMPY_TYPES`) are read at their own width and converted to doubles.
+    Setting `compact` keeps them in the type they were written with instead, so for example single precision output
+    stays float32 and takes half the memory.
 
-                    # If it's a double
-                    if (data_type == 'double'):
-                        # Get the array
-                        screen_tout_arrays[block_name] = numpy.fromfile(file, dtype=numpy.dtype('d'),
-                                                                        count=block_size // 8)
+    Instead of walking the file, the touts and screens can be read straight from a table of contents made by
+    `build_index` or `load_index` by passing it as `index`.  Only the blocks accepted by the filters are visited and
+    each of their variables is found with a single seek, so this is the safe replacement for `screen_block_size` and
+    `tout_block_size`.
 
-                    # Otherwise
-                    else:
-                        # Skip ahead
-                        file.seek(block_size, 1)
+    Example Usage:
 
-                # If it's time to end the block
-                elif (end):
-                    if (state == 'tout'):
-                        # Append it to the list
-                        touts.append(screen_tout_arrays)
+    # Load the EasyGDF module
+    import easygdf
 
-                    elif (state == 'screen'):
-                        # Append it to the list
-                        screens.append(screen_tout_arrays)
+    # Open a GDF file
+    with open('output.gdf', 'rb') as f:
+      touts, screens = easygdf.load(f)
+    '''
 
-                    # Change the state back
-                    state = 'root'
+    # Make holders for our phase space variables
+    touts = []
+    screens = []
 
-                # Otherwise
-                else:
-                    # Skip ahead
-                    file.seek(block_size, 1)
+    # For each tout and screen in the file
+    for block in iter_blocks(file, tout_filter=tout_filter, screen_filter=screen_filter,
+                             screen_block_size=screen_block_size, tout_block_size=tout_block_size, columns=columns,
+                             use_mmap=use_mmap, index=index, compact=compact):
+        # Append its arrays to the right list
+        if (block.kind == 'tout'):
+            touts.append(block.arrays)
+        else:
+            screens.append(block.arrays)
 
     # Return everything
     return (touts, screens)
@@ -605,10 +499,9 @@ def load_initial_distribution(file, extra_screen_keys=[]):
                 'nmacro']
 
         # If we are the start of a tout block
-        if(block_name in parameter_names):
+        if((block_name in parameter_names or block_name in extra_screen_keys) and _is_numeric(block_type_flag)):
             # Get the value of it
-            val = numpy.fromfile(file, dtype=numpy.dtype('d'),
-                    count=block_size//8)
+            val = _read_typed_array(file, None, block_type_flag, block_size, False)
 
             # Add it to the dict
             values[block_name]  = val
@@ -618,24 +511,11 @@ def load_initial_distribution(file, extra_screen_keys=[]):
             # Move us to the next block
             file.seek(block_size, 1)
 
-    # Generate the screen
-    screen = numpy.array([
-        values['x'],
-        values['GBx'],
-        values['y'],
-        values['GBy'],
-        values['z'],
-        values['GBz'],
-        values['t'],
-        ])
-
-    # Get the charge per macroparticle
-    q = values['q'] * values['nmacro']
-
-    # Add extra values
-    for key in extra_screen_keys:
-        # Add the key
-        screen = numpy.append(screen, [values[key]], axis=0)
+    # Allocate the screen and fill it in
+    keys = ['x', 'GBx', 'y', 'GBy', 'z', 'GBz', 't'] + list(extra_screen_keys)
+    screen = numpy.empty((len(keys), values['x'].shape[0]))
+    for row, key in enumerate(keys):
+        screen[row] = values[key]
 
     # Return everything
     return screen
@@ -721,10 +601,9 @@ def load_initial_distribution_dict(file):
                 'nmacro']
 
         # If we are the start of a tout block
-        if(block_name in parameter_names):
+        if(block_name in parameter_names and _is_numeric(block_type_flag)):
             # Get the value of it
-            val = numpy.fromfile(file, dtype=numpy.dtype('d'),
-                    count=block_size//8)
+            val = _read_typed_array(file, None, block_type_flag, block_size, False)
 
             # Add it to the dict
             values[block_name]  = val
@@ -738,6 +617,745 @@ def load_initial_distribution_dict(file):
     return values
 
 
+def load_arrays(file, keys=None, use_mmap=False, compact=False):
+    '''Reads the root level arrays of a GDF file, the layout used by initial distributions and field maps.  The output
+    of this function is a dict of the numeric arrays in the open file object file, keyed by their names and in the
+    order they appear in the file.  When `keys` is given only the arrays named in it are read and the rest of the data
+    is skipped over.  `use_mmap` and `compact` behave as described in `load_dict`.  Touts and screens are skipped; use `load_dict`
+    for those.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Open a GDF file
+    with open('field_map.gdf', 'rb') as f:
+      field_map = easygdf.load_arrays(f)
+    '''
+    # Check the file
+    _check_file(file)
+
+    # Map the file into memory if requested
+    buffer = _get_buffer(file, use_mmap)
+
+    # Jump to where the data actually begins
+    file.seek(48)
+
+    # Make holders for the arrays
+    arrays = {}
+    depth = 0
+
+    # Go into an infinite loop
+    while True:
+        # Read the block's header
+        block_header = file.read(16 + 4 + 4)
+
+        # If no data came back, end the loop
+        if len(block_header) < 24:
+            break
+
+        # Clean up the name
+        block_name = block_header[0:16]
+        block_name = block_name.split(b'\0', 1)[0]
+        block_name = block_name.decode('utf8')
+
+        # Get the block's type_flag and size
+        block_type_flag, block_size = struct.unpack('ii', block_header[16:24])
+
+        # Keep track of whether we are inside of a tout or screen
+        if (block_type_flag & GDF_DIRECTORY) or (block_name == 'time') or (block_name == 'position'):
+            depth += 1
+        elif (block_type_flag & GDF_END):
+            depth = max(depth - 1, 0)
+
+        # If it's a root level array of numbers we were asked for
+        if ((depth == 0) and (block_type_flag & GDF_ARRAY) and _is_numeric(block_type_flag)
+                and ((keys is None) or (block_name in keys))):
+            # Get the array
+            arrays[block_name] = _read_typed_array(file, buffer, block_type_flag, block_size, compact)
+
+        # Otherwise
+        else:
+            # Move us to the next block
+            file.seek(block_size, 1)
+
+    # Return everything
+    return arrays
+
+
+def load_array_names(file):
+    '''Returns the names of the root level numeric arrays of a GDF file, the arrays `load_arrays` would read from the
+    open file object file, in the order they appear in the file.  Only the block headers are read.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Get the columns of a field map
+    with open('field_map.gdf', 'rb') as f:
+      columns = easygdf.load_array_names(f)
+    '''
+    # Check the file
+    _check_file(file)
+
+    # Decode every block header in one go
+    _, headers, _ = _read_headers(file)
+
+    # Walk them as load_arrays walks the blocks
+    names = {}
+    depth = 0
+    for block_name, block_type_flag, _ in headers.tolist():
+        # Clean up the name
+        block_name = block_name.split(b'\0', 1)[0].decode('utf8')
+
+        # Keep track of whether we are inside of a tout or screen
+        if (block_type_flag & GDF_DIRECTORY) or (block_name == 'time') or (block_name == 'position'):
+            depth += 1
+        elif (block_type_flag & GDF_END):
+            depth = max(depth - 1, 0)
+
+        # If it's a root level array of numbers
+        if (depth == 0) and (block_type_flag & GDF_ARRAY) and _is_numeric(block_type_flag):
+            names[block_name] = None
+
+    # Return the names
+    return list(names)
+
+
+def save_dict(file, arrays, creator='easygdf', destination=''):
+    '''Writes a GDF file made of the root level arrays in the dict arrays to the open file object file.  This is the
+    layout of the initial distributions and field maps read by GPT.  Each array is written straight from its NumPy
+    buffer as doubles, so no ASCII representation of the data is ever made.  The keys of the dict become the names of
+    the arrays in the file and must be shorter than 16 characters.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Write a GDF file
+    with open('initial_distribution.gdf', 'wb') as f:
+      easygdf.save_dict(f, {'x': x, 'y': y, 'z': z, 'GBx': GBx, 'GBy': GBy, 'GBz': GBz})
+    '''
+    # Check the file
+    _check_writable_file(file)
+
+    # Write the file header
+    _write_header(file, creator, destination)
+
+    # Write each of the arrays
+    for name, array in arrays.items():
+        _write_array(file, name, array)
+
+
+def save(file, blocks, creator='easygdf', destination=''):
+    '''Writes the touts and screens in blocks to the open file object file in the layout of a GPT output file.  Each
+    entry of blocks is a `GDFBlock` record (or a tuple of `kind`, `value` and `arrays`) as yielded by `iter_blocks`,
+    so a file can be filtered or rewritten without leaving python.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Keep only the screens of a file
+    with open('output.gdf', 'rb') as f, open('screens.gdf', 'wb') as g:
+      easygdf.save(g, (block for block in easygdf.iter_blocks(f) if block.kind == 'screen'))
+    '''
+    # Check the file
+    _check_writable_file(file)
+
+    # Write the file header
+    _write_header(file, creator, destination)
+
+    # For each tout or screen
+    for kind, value, arrays in blocks:
+        # Start the block with its time or position
+        if (kind == 'tout'):
+            _write_single(file, 'time', value, GDF_DIRECTORY)
+        elif (kind == 'screen'):
+            _write_single(file, 'position', value, GDF_DIRECTORY)
+        else:
+            raise ValueError('Unknown block kind: ' + str(kind))
+
+        # Write each of the arrays
+        for name, array in arrays.items():
+            _write_array(file, name, array)
+
+        # Close the block
+        _write_block_header(file, '', GDF_END, 0)
+
+
+class GDFTail:
+    '''Follows a GDF file that is still being written, such as the output of a running GPT simulation.  Each call to
+    `poll` returns the touts and screens completed since the previous call as `GDFBlock` records.  A tout or screen is
+    only handed out once its end marker is in the file, so partially written blocks are never seen; they are read
+    again on the next call.  Pass `final=True` once the writer has finished to also get a last block that was closed
+    by the end of the file rather than an end marker.
+
+    The `columns` and `compact` parameters select the arrays to read and their types as in `iter_blocks`.
+
+    Example Usage:
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Print each tout and screen as it is written
+    tail = easygdf.GDFTail('gpt.out.gdf')
+    while gpt_is_running():
+      for block in tail.poll():
+        print(block.kind, block.value)
+      time.sleep(1)
+    '''
+    def __init__(self, filename, columns=None, compact=False):
+        # Use the same columns for both kinds of block unless told otherwise
+        if not isinstance(columns, dict):
+            columns = {'tout': columns, 'screen': columns}
+
+        self.filename = filename
+        self.columns = columns
+        self.compact = compact
+
+        # Where the next unread block starts
+        self.offset = 48
+
+    def poll(self, final=False):
+        '''Returns a list of the touts and screens completed since the last call.'''
+        # The file may not have been created yet
+        try:
+            file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return []
+
+        with file:
+            # Wait for the file header to be written
+            size = os.fstat(file.fileno()).st_size
+            if size < 48:
+                return []
+
+            # Check it against the real magic number
+            if (self.offset == 48) and (not is_GDF_file(file)):
+                raise ValueError('File is not GDF formatted')
+
+            # Make a variable to keep track of state
+            blocks = []
+            state = 'root'
+            position = self.offset
+
+            # Go until we run out of complete data
+            while position + 24 <= size:
+                # Read the block's header
+                file.seek(position)
+                block_header = file.read(16 + 4 + 4)
+                position = position + 24
+
+                # Clean up the name
+                block_name = block_header[0:16]
+                block_name = block_name.split(b'\0', 1)[0]
+                block_name = block_name.decode('utf8')
+
+                # Get the block's type_flag and size
+                block_type_flag, block_size = struct.unpack('ii', block_header[16:24])
+
+                # If we are in the root state
+                if (state == 'root'):
+                    # If we are the start of a tout or a screen
+                    if (block_name == 'time') or (block_name == 'position'):
+                        # Wait for the value to be written
+                        if position + 8 > size:
+                            break
+
+                        # Start the new block
+                        block_value, = struct.unpack('d', file.read(8))
+                        position = position + 8
+                        state = 'tout' if (block_name == 'time') else 'screen'
+                        arrays = {}
+
+                    # If it's just some random block
+                    else:
+                        # Wait for it to be written
+                        if position + block_size > size:
+                            break
+
+                        # Move past it for good
+                        position = position + block_size
+                        self.offset = position
+
+                # If it's an array in a tout or a screen
+                elif (block_type_flag & GDF_ARRAY):
+                    # Wait for it to be written
+                    if position + block_size > size:
+                        break
+
+                    # Read it if it's a number we were asked for
+                    keys = self.columns[state]
+                    if _is_numeric(block_type_flag) and ((keys is None) or (block_name in keys)):
+                        arrays[block_name] = _read_typed_array(file, None, block_type_flag, block_size, self.compact)
+
+                    # Move past it
+                    position = position + block_size
+
+                # If it's time to end the block
+                elif (block_type_flag & GDF_END):
+                    # Hand out the finished block and move past it for good
+                    blocks.append(GDFBlock(state, block_value, arrays))
+                    state = 'root'
+                    self.offset = position
+
+                # Otherwise
+                else:
+                    # Wait for it to be written, then skip it
+                    if position + block_size > size:
+                        break
+                    position = position + block_size
+
+            # A finished file may end in the middle of a block
+            if final and (state != 'root') and (position == size):
+                blocks.append(GDFBlock(state, block_value, arrays))
+                self.offset = position
+
+        return blocks
+
+
+def follow_blocks(filename, is_running, poll_interval=1.0, columns=None, compact=False):
+    '''Generator that yields the touts and screens of a GDF file as `GDFBlock` records while it is being written.  The
+    file is polled every `poll_interval` seconds for as long as `is_running()` returns True, then read one last time.
+    See `GDFTail` for the details.
+
+    Example Usage:
+
+    # Follow a GPT run started with subprocess.Popen
+    for block in easygdf.follow_blocks('gpt.out.gdf', lambda: process.poll() is None):
+      print(block.kind, block.value)
+    '''
+    # Start following the file
+    tail = GDFTail(filename, columns=columns, compact=compact)
+
+    # Hand out blocks as they are finished
+    while is_running():
+        yield from tail.poll()
+        time.sleep(poll_interval)
+
+    # Pick up whatever was written at the end
+    yield from tail.poll(final=True)
+
+
+def build_index(file):
+    '''Builds a table of contents for the touts and screens in the open file object file.  Only the block headers
+    are read; all of the particle data is skipped over.  The table of contents is a list of dicts, one per tout or
+    screen in file order, with the keys:
+
+        'kind'   : 'tout' or 'screen'
+        'value'  : the time of the tout or the position of the screen
+        'offset' : the byte offset of the block's header in the file
+        'n'      : the number of particles in the block
+        'arrays' : dict mapping each array name to [offset of its data, GDF type flag, size in bytes]
+
+    The result can be passed to `load` and `load_dict` as `index` or to `read_block` to read any subset of touts and
+    screens without rescanning the file.  See `load_index` for a version cached on disk.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Open a GDF file
+    with open('output.gdf', 'rb') as f:
+      index = easygdf.build_index(f)
+      last_screen = easygdf.read_block(f, index[-1])
+    '''
+    # Check the file
+    _check_file(file)
+
+    # Decode every block header in one go
+    offsets, headers, firsts = _read_headers(file)
+    names = headers['name']
+    type_flags = headers['type']
+    sizes = headers['size']
+
+    # Find where the touts and screens start and end
+    is_tout = (names == b'time')
+    is_screen = (names == b'position')
+    starts = is_tout | is_screen
+    ends = (type_flags & GDF_END) != 0
+
+    # Number each tout and screen; a header belongs to one if it started and has not ended yet
+    block_number = numpy.cumsum(starts) - 1
+    in_block = numpy.cumsum(starts) > (numpy.cumsum(ends) - ends)
+
+    # Get the times and positions, which are the doubles following the start headers
+    start_offsets = offsets[starts]
+    values = numpy.ascontiguousarray(firsts[starts]).view('d').reshape(-1)
+
+    # Start an entry for each tout and screen
+    index = [{'kind': 'tout' if tout else 'screen', 'value': value, 'offset': offset, 'n': 0, 'arrays': {}}
+             for tout, value, offset in zip(is_tout[starts].tolist(), values.tolist(), start_offsets.tolist())]
+
+    # Record where the data of each of their arrays lives
+    arrays = in_block & ((type_flags & GDF_ARRAY) != 0)
+    decoded = {}
+    for number, name, offset, block_type_flag, block_size in zip(block_number[arrays].tolist(),
+                                                                  names[arrays].tolist(),
+                                                                  (offsets[arrays] + 24).tolist(),
+                                                                  type_flags[arrays].tolist(),
+                                                                  sizes[arrays].tolist()):
+        # Clean up the name
+        if name not in decoded:
+            decoded[name] = name.split(b'\0', 1)[0].decode('utf8')
+        name = decoded[name]
+
+        block = index[number]
+        block['arrays'][name] = [offset, block_type_flag, block_size]
+
+        # Use the positions to count the particles
+        if (name == 'x') and _is_numeric(block_type_flag):
+            block['n'] = block_size // _get_numpy_dtype(block_type_flag).itemsize
+
+    # Return the table of contents
+    return index
+
+
+def load_index(filename, cache=True):
+    '''Returns the table of contents (see `build_index`) for the GDF file at filename.  When `cache` is set, the
+    table of contents is stored in the sidecar file `filename + '.index'` and reused as long as the size and
+    modification time of the GDF file still match, so only the first call has to scan the file.'''
+    # Get the stamp we check the sidecar against
+    stat = os.stat(filename)
+    stamp = {'version': GDF_INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    sidecar = filename + '.index'
+
+    # Try the cached copy first
+    if cache and os.path.exists(sidecar):
+        try:
+            with open(sidecar, 'r') as f:
+                saved = json.load(f)
+
+            # If it was made from this version of the file, use it
+            if all(saved.get(key) == value for key, value in stamp.items()):
+                return saved['blocks']
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Scan the file
+    with open(filename, 'rb') as f:
+        index = build_index(f)
+
+    # Save it for next time, skipping quietly if we can't write next to the file
+    if cache:
+        try:
+            with open(sidecar, 'w') as f:
+                json.dump(dict(stamp, blocks=index), f)
+
+        except OSError:
+            pass
+
+    return index
+
+
+def read_block(file, block, keys=None, use_mmap=False, compact=False):
+    '''Reads one tout or screen described by an entry of the table of contents (see `build_index`) from the open
+    file object file.  Returns a dict of the numeric arrays in the block, or only of those named in `keys`, converted
+    to doubles unless `compact` is set.  Every
+    array is found with a single seek, so reading a block costs the same wherever it sits in the file.'''
+    return _read_block(file, _get_buffer(file, use_mmap), block, keys, compact)
+
+
+def map_blocks(file, blocks, function, keys=None, max_workers=None, compact=False):
+    '''Calls function(block, arrays) for each table of contents entry in blocks (see `build_index`), where arrays is
+    the dict returned by `read_block`, and returns the results in the order of blocks.  The open file object file is
+    memory-mapped and the blocks are read and handed to function by a pool of `max_workers` threads.  NumPy releases
+    the GIL while copying and doing arithmetic on large arrays, so decoding many large blocks this way scales with
+    the number of cores.  The arrays are read-only views into the mapping, except for those converted to doubles
+    when `compact` is not set (see `load_dict`).  `keys` is a list of the arrays to read,
+    or a dict of such lists with the keys 'tout' and 'screen' as in `iter_blocks`.
+
+    # Load the EasyGDF module
+    import easygdf
+
+    # Open a GDF file and find the beam size in every block
+    with open('output.gdf', 'rb') as f:
+      index = easygdf.build_index(f)
+      sigma_x = easygdf.map_blocks(f, index, lambda block, arrays: arrays['x'].std(), keys=['x'], max_workers=8)
+    '''
+    # Check the file
+    _check_file(file)
+
+    # Map the file into memory
+    buffer = _get_buffer(file, True)
+
+    # Use the same keys for both kinds of block unless told otherwise
+    if not isinstance(keys, dict):
+        keys = {'tout': keys, 'screen': keys}
+
+    def read(block):
+        # Pick the arrays we were asked for that the block has
+        block_keys = keys[block['kind']]
+        if block_keys is not None:
+            block_keys = [key for key in block['arrays'] if key in block_keys]
+
+        # Without a mapping (an empty file) fall back on the file itself
+        return function(block, _read_block(file if (buffer is None) else None, buffer, block, block_keys, compact))
+
+    # There is nothing to share between threads in an empty file
+    if buffer is None:
+        return [read(block) for block in blocks]
+
+    # Decode the blocks in the pool; map hands back the results in order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(read, blocks))
+
+
+def _read_block(file, buffer, block, keys=None, compact=False):
+    '''Reads the arrays named in keys (all of them if None) of the table of contents entry block.'''
+    # Choose what to read
+    if keys is None:
+        keys = block['arrays'].keys()
+
+    # Read each array
+    arrays = {}
+    for key in keys:
+        # Look up where it lives
+        offset, block_type_flag, block_size = block['arrays'][key]
+
+        # Read it if it's a number
+        if _is_numeric(block_type_flag):
+            # Views into a mapping don't move the file position, so they can be taken from several threads
+            if buffer is not None:
+                arrays[key] = _read_typed_array(None, buffer, block_type_flag, block_size, compact, offset)
+            else:
+                file.seek(offset)
+                arrays[key] = _read_typed_array(file, None, block_type_flag, block_size, compact)
+
+    return arrays
+
+
+def _filter_index(index, tout_filter, screen_filter):
+    '''Yields the entries of a table of contents that pass the tout or screen filter.'''
+    for block in index:
+        if (block['kind'] == 'tout') and tout_filter(block['value']):
+            yield block
+        elif (block['kind'] == 'screen') and screen_filter(block['value']):
+            yield block
+
+
+def _make_phase_space_array(kind, arrays, block_value, extra_keys):
+    '''Builds the phase space array described in `load` from the arrays of a tout or screen.  The output is allocated
+    once and every row, including the momenta, is written into it in place.'''
+    # Allocate the whole output
+    G = arrays['G']
+    phase_space_array = numpy.empty((7 + len(extra_keys), G.shape[0]))
+
+    # Fill in the positions and the momenta Beta*Gamma
+    for row, key in enumerate(['x', 'Bx', 'y', 'By', 'z', 'Bz']):
+        if (row % 2):
+            numpy.multiply(arrays[key], G, out=phase_space_array[row])
+        else:
+            phase_space_array[row] = arrays[key]
+
+    # Touts share the time of the block, screens record the time of each particle
+    if (kind == 'tout'):
+        phase_space_array[6] = block_value
+    else:
+        phase_space_array[6] = arrays['t']
+
+    # Fill in the extra rows
+    for row, key in enumerate(extra_keys, 7):
+        phase_space_array[row] = arrays[key]
+
+    return phase_space_array
+
+
+def _check_file(file):
+    '''Raises an exception unless file is an open, readable GDF file object in binary mode.'''
+    # Check if the file is a real file object
+    if (not isinstance(file, io.IOBase)):
+        raise TypeError('Argument is not a file-like object')
+
+    # If the file wasn't opened in binary mode
+    if 'b' not in file.mode:
+        # Raise an exception
+        raise ValueError("File is not in binary mode.  "
+                         "Try opening with option 'rb'")
+
+    # Check if the file is readable
+    try:
+        file.read(1)
+
+    except IOError:
+        raise ValueError('Could not read from file')
+
+    # Check it against the real magic number
+    if (not is_GDF_file(file)):
+        raise ValueError('File is not GDF formatted')
+
+
+def _read_headers(file):
+    '''Finds every block header in the open file object file and decodes them all at once.  Returns the offsets of the
+    headers, a structured array (see `GDF_HEADER_DTYPE`) of the headers and an (n, 8) array of the first 8 bytes of
+    each block's data, zero padded, which hold the value of the single blocks.'''
+    # Map the file into memory, or walk the headers with seek and read if it can't be mapped
+    try:
+        buffer = _get_buffer(file, True)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        buffer = None
+
+    if buffer is None:
+        offsets, records = _walk_headers(file)
+
+    else:
+        # Hop from header to header using only the block sizes
+        offsets = []
+        offset = 48
+        end = len(buffer) - 24
+        unpack_from = struct.unpack_from
+        while offset <= end:
+            offsets.append(offset)
+            offset += 24 + unpack_from('i', buffer, offset + 20)[0]
+
+        # Gather each header with the 8 bytes after it, padding past the end of the file with zeros
+        offsets = numpy.array(offsets, dtype=numpy.int64)
+        raw = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        positions = offsets[:, None] + numpy.arange(32)
+        records = raw[numpy.minimum(positions, len(raw) - 1)]
+        records[positions >= len(raw)] = 0
+
+    # Decode all of the headers with a single view
+    headers = numpy.ascontiguousarray(records[:, :24]).view(GDF_HEADER_DTYPE).reshape(-1)
+
+    return offsets, headers, records[:, 24:]
+
+
+def _walk_headers(file):
+    '''Reads the block headers of the open file object file one at a time, seeking over the data in between.  Returns
+    the offsets of the headers and an (n, 32) array of each header with the 8 bytes after it, zero padded.'''
+    end = file.seek(0, 2) - 24
+
+    offsets = []
+    records = bytearray()
+    offset = 48
+    while offset <= end:
+        file.seek(offset)
+        record = file.read(32).ljust(32, b'\0')
+        offsets.append(offset)
+        records += record
+        offset += 24 + struct.unpack_from('i', record, 20)[0]
+
+    return numpy.array(offsets, dtype=numpy.int64), numpy.frombuffer(bytes(records), dtype=numpy.uint8).reshape(-1, 32)
+
+
+def _check_writable_file(file):
+    '''Raises an exception unless file is an open, writable file object in binary mode.'''
+    # Check if the file is a real file object
+    if (not isinstance(file, io.IOBase)):
+        raise TypeError('Argument is not a file-like object')
+
+    # If the file wasn't opened in binary mode
+    if 'b' not in file.mode:
+        # Raise an exception
+        raise ValueError("File is not in binary mode.  "
+                         "Try opening with option 'wb'")
+
+    # Check if the file is writable
+    if (not file.writable()):
+        raise ValueError('Could not write to file')
+
+
+def _write_header(file, creator, destination):
+    '''Writes the 48 byte GDF file header.'''
+    file.write(struct.pack('ii16s16s8B', GDF_MAGIC, int(time.time()), _encode_name(creator),
+                           _encode_name(destination), 1, 1, 1, 0, 0, 0, 0, 0))
+
+
+def _write_block_header(file, name, type_flag, size):
+    '''Writes the header of a block with the given name, type flag and size in bytes.'''
+    file.write(struct.pack('16sii', _encode_name(name), type_flag, size))
+
+
+def _write_single(file, name, value, type_flag=0):
+    '''Writes a block holding the single double value.'''
+    _write_block_header(file, name, type_flag | GDF_SINGLE | GDF_DOUBLE, 8)
+    file.write(struct.pack('d', value))
+
+
+def _write_array(file, name, array):
+    '''Writes a block holding array as doubles, directly from its buffer when it already is a contiguous array of
+    doubles.'''
+    # Get the data as a flat run of doubles
+    data = numpy.ascontiguousarray(array, dtype=numpy.dtype('d')).reshape(-1)
+
+    # Write the header and the data
+    _write_block_header(file, name, GDF_ARRAY | GDF_DOUBLE, data.nbytes)
+    file.write(data.data)
+
+
+def _encode_name(name):
+    '''Returns name as the null padded bytes used for names in GDF files.'''
+    encoded = name.encode('utf8')
+
+    # Leave room for the terminating null
+    if len(encoded) >= GDF_NAME_LEN:
+        raise ValueError('GDF names must be shorter than ' + str(GDF_NAME_LEN) + ' bytes: ' + name)
+
+    return encoded
+
+
+def _get_buffer(file, use_mmap):
+    '''Returns a read-only memory map of the open file object file when use_mmap is set and None otherwise.'''
+    # If we aren't mapping the file, or there is nothing to map
+    if (not use_mmap) or (file.seek(0, 2) == 0):
+        return None
+
+    # Map the whole file
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _is_numeric(block_type_flag):
+    '''Returns whether the GDF type flag is that of a numeric data type (see `GDF_NUMPY_TYPES`).'''
+    return (block_type_flag & 255) in GDF_NUMPY_TYPES
+
+
+def _get_numpy_dtype(block_type_flag):
+    '''Returns the NumPy dtype of the numeric GDF type flag.'''
+    return numpy.dtype(GDF_NUMPY_TYPES[block_type_flag & 255])
+
+
+def _read_typed_array(file, buffer, block_type_flag, block_size, compact, offset=None):
+    '''Reads an array of the numeric type in block_type_flag that takes up block_size bytes, at offset in the buffer
+    when it is given and at the file position otherwise.  Unless compact is set, the array is converted to doubles.'''
+    # Work out what is stored
+    dtype = _get_numpy_dtype(block_type_flag)
+    count = block_size // dtype.itemsize
+
+    # Read it at its own width
+    if offset is not None:
+        array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+    else:
+        array = _read_array(file, buffer, dtype, count)
+
+    # Convert it if asked to
+    if (not compact) and (dtype != numpy.dtype('d')):
+        array = array.astype(numpy.dtype('d'))
+
+    return array
+
+
+def _read_array(file, buffer, dtype, count):
+    '''Reads count values of type dtype at the current position of file and moves the file past them.  When buffer
+    is a memory map of the file, a read-only view into the mapping is returned instead of a copy.'''
+    # Without a mapping, read the data out of the file straight into a new array
+    if buffer is None:
+        array = numpy.empty(count, dtype=dtype)
+        read = file.readinto(array)
+
+        # Complain if the file ended early
+        if (read or 0) != array.nbytes:
+            raise ValueError('File ended in the middle of an array')
+
+        return array
+
+    # Otherwise take a view into the mapping at the file position
+    offset = file.tell()
+    array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+    # Move past the data
+    file.seek(offset + array.nbytes)
+
+    return array
+
+
 def get_data_type(flag):
     '''This method returns a string identifying the datatype of a GDF block
     given the last byte of it'''
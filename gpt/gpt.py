@@ -1,8 +1,14 @@
 from gpt import tools, parsers
-from gpt.particles import particle_stats, raw_data_to_particle_groups
+from gpt.particles import particle_stats, raw_data_to_particle_groups, LazyParticleGroups, gdf_to_particle_groups
+from gpt.particles import gdf_block_to_particle_group, write_particle_group_gdf
+from gpt.particles import particle_histories, particle_group_histories, particle_trajectories
+from gpt.particles import centroid_path_length
+from gpt.particles import gdf_timeline, particle_groups_timeline
+from gpt.particles import ParticleHistory, particle_history_stats, DEFAULT_MAX_CACHED_GROUPS
+from gpt.particles import centroid_coordinates_history, transform_groups_to_centroid_coordinates
+from gpt import easygdf
 from gpt.parsers import parse_gpt_string
 from .plot import plot_stats_with_layout
-from gpt.tools import transform_to_centroid_coordinates
 from gpt.tools import full_path
 
 from gpt.gpt_phasing import gpt_phasing
@@ -18,12 +24,14 @@ from gpt.gpt_tao import gpt_from_tao
 
 from gpt.lattice import Lattice
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from copy import deepcopy
 import h5py
 import numpy as np
 import os
 import tempfile
 from time import time
+import traceback
 
 c = 299792458
 
@@ -61,7 +69,12 @@ class GPT:
                  load_fields=False,
                  parse_layout=True,
                  copy_support_files=False,
-                 n_cpu=1):
+                 n_cpu=1,
+                 use_mmap=False,
+                 lazy_output=False,
+                 columns=None,
+                 max_workers=None,
+                 cache_output=False):
 
         # Save init
         self.original_input_file = input_file
@@ -97,7 +110,11 @@ class GPT:
         self.parse_layout=parse_layout
         self.copy_support_files=copy_support_files
         self.n_cpu = n_cpu
-
+        self.use_mmap = use_mmap
+        self.lazy_output = lazy_output
+        self.columns = columns
+        self.max_workers = max_workers
+        self.cache_output = cache_output
         
 
         # Call configure
@@ -233,20 +250,77 @@ class GPT:
         
     
     def load_output(self, file='gpt.out.gdf'):
-        """ loads the GPT raw data and puts it into particle groups """
+        """ 
+        loads the GPT raw data and puts it into particle groups 
+
+        With lazy_output (and no load_fields), .output['particles'] only indexes the file: 
+        each tout or screen is read and converted when it is first accessed. 
+        Otherwise the whole file is read, in a pool of max_workers threads if set (see parsers.read_gdf_file).
+
+        With cache_output (and no load_fields), the converted particles are kept in a cache file next to 
+        the output and later loads of the same file read them from there (see particles.read_particle_cache).
+        """
 
         self.vprint(f'   Loading GPT data from {self.get_gpt_output_file()}')
+
+        self.clear_output_cache()
+        self.output.pop('tout_centroids', None)
+
+        if(self.cache_output and not self.load_fields):
+
+            touts, screens, fields = gdf_to_particle_groups(file, verbose=self.verbose, columns=self.columns, max_workers=self.max_workers, use_cache=True)
+
+            self._set_particle_output(touts, screens, fields)
+
+            return
+
+        if(self.lazy_output and not self.load_fields):
+
+            tout_blocks, screen_blocks = parsers.read_gdf_blocks(file)
+
+            self.output['particles'] = LazyParticleGroups(file, tout_blocks+screen_blocks, ref_ccs=self.ref_ccs, use_mmap=self.use_mmap, columns=self.columns)
+            self.output['n_tout'] = len(tout_blocks)
+            self.output['n_screen'] = len(screen_blocks)
+
+            self.output['fields'] = [None]*len(tout_blocks)
+
+            return
         
-        touts, screens, fields = parsers.read_gdf_file(file, self.verbose, load_fields=self.load_fields)  # Raw GPT data
+        touts, screens, fields = parsers.read_gdf_file(file, self.verbose, load_fields=self.load_fields, use_mmap=self.use_mmap, columns=self.columns, max_workers=self.max_workers)  # Raw GPT data
 
         #print(self.load_fields, fields)
 
-        self.output['particles'] = raw_data_to_particle_groups(touts, screens, verbose=self.verbose, ref_ccs=self.ref_ccs) 
+        particle_groups = raw_data_to_particle_groups(touts, screens, verbose=self.verbose) 
+
+        self._set_particle_output(particle_groups[:len(touts)], particle_groups[len(touts):], fields)
+
+    def _set_particle_output(self, touts, screens, fields):
+        """ 
+        Stores the tout and screen ParticleGroups read into memory as the output. With ref_ccs the touts are 
+        transformed to their centroid coordinate systems, and their centroids are kept in output['tout_centroids'] for the timeline.
+        """
+        if(self.ref_ccs):
+            self.output['tout_centroids'] = particle_stats(touts, ['mean_x', 'mean_y', 'mean_z'])
+            touts = transform_groups_to_centroid_coordinates(touts)
+
+        self.output['particles'] = touts + screens
         self.output['n_tout'] = len(touts)
         self.output['n_screen'] = len(screens)
         
         self.output['fields']=fields
 
+    def clear_output_cache(self):
+        """ 
+        Drops everything derived from the output particles: the timeline, particle histories, tout_ccs, memoized stats and s_ccs, 
+        and the groups decoded by lazy output. Done whenever the output is replaced, call it after changing the particle groups in place.
+        """
+        for key in ['particles', 'tout_ccs']:
+            if(isinstance(self.output.get(key), LazyParticleGroups)):
+                self.output[key].close()
+
+        for key in ['timeline', 'histories', 'tout_ccs', 'stats', 's_ccs']:
+            self.output.pop(key, None)
+
     @property
     def n_tout(self):
         """ number of tout particle groups """
@@ -257,6 +331,34 @@ class GPT:
         """ number of screen particle groups"""
         return self.output['n_screen']
 
+    @property
+    def timeline(self):
+        """ 
+        Index of the touts and screens by time, mean z and s, in the order of .particles (see particles.Timeline). 
+        Built on first use. With lazy output only the centroid columns are read from the output file. 
+        With ref_ccs the tout positions are those of the centroids before the touts were transformed, as with lazy output.
+        """
+        if('particles' not in self.output):
+            return None
+
+        if('timeline' not in self.output):
+
+            particles = self.output['particles']
+
+            if(isinstance(particles, LazyParticleGroups)):
+                self.output['timeline'] = gdf_timeline(particles.gdffile, particles.blocks)
+            else:
+                self.output['timeline'] = particle_groups_timeline(particles, self.output['n_tout'], tout_centroids=self.output.get('tout_centroids'))
+
+        return self.output['timeline']
+
+    def select_particles(self, low, high, key='time', data_type=None):
+        """ 
+        Returns the particle groups with low <= key <= high, where key is 'time', 'mean_z' or 's', 
+        in order of key. data_type can restrict the search to 'tout' or 'screen'. Only the matching groups are loaded.
+        """
+        return [self.particles[ii] for ii in self.timeline.between(low, high, key=key, kind=data_type)]
+
     @property
     def tout(self):
         """ Returns output particle groups for touts """
@@ -264,43 +366,95 @@ class GPT:
             return self.output['particles'][:self.output['n_tout']]
 
     @property
-    def tout_ccs(self):
-        """ Returns output particle groups for touts transformed into centroid coordinate system """
-        if('particles' in self.output):
-            return [transform_to_centroid_coordinates(tout) for tout in self.tout]
+    def history(self):
+        """ 
+        Touts stored as contiguous columns (see particles.ParticleHistory), built on first use. 
+        history[i] is a read-only view of tout i and reductions over all touts are single array operations:
+
+            G.history.mean('x')
+        """
+        if('particles' not in self.output):
+            return None
+
+        return self.particle_history('tout')
+
+    def particle_history(self, data_type='tout'):
+        """ 
+        ParticleHistory of the 'tout', 'tout_ccs' or 'screen' particle groups, built on first use. 
+        The columns are read-only, so the groups can not go out of step with the memoized stats.
+        """
+
+        if(data_type not in ['tout', 'tout_ccs', 'screen']):
+            raise ValueError(f'Unsupported GPT data type: {data_type}')
+
+        histories = self.output.setdefault('histories', {})
+
+        if(data_type not in histories):
+            if(data_type=='tout_ccs'):
+                histories[data_type] = centroid_coordinates_history(self.particle_history('tout'))
+            else:
+                histories[data_type] = ParticleHistory.from_particle_groups(getattr(self, data_type))
+
+            for column in histories[data_type].columns.values():
+                column.setflags(write=False)
+
+        return histories[data_type]
 
     @property
-    def s_ccs(self):
+    def tout_ccs(self):
+        """ 
+        Returns output particle groups for touts transformed into centroid coordinate system, as a list. 
+        All touts are transformed together on first use (see particles.centroid_coordinates_history) 
+        and the groups are read-only views into the cached result: use pg.copy() for a group that can be changed. 
+        With lazy output this is a LazyParticleGroups instead, which transforms each tout when it is read.
+        """
+        if('particles' not in self.output):
+            return None
 
-        
-        s = [np.sqrt(self.tout[0]['mean_x']**2+self.tout[0]['mean_y']**2+self.tout[0]['mean_z']**2 )]
+        if('tout_ccs' not in self.output):
 
-        current_tout = self.tout[0]
-        current_p = current_tout['mean_p']
+            particles = self.output['particles']
 
-        for next_tout in self.tout[1:]:
+            if(isinstance(particles, LazyParticleGroups)):
+                touts = particles[:self.output['n_tout']]
+                self.output['tout_ccs'] = LazyParticleGroups(touts.gdffile, touts.blocks, ref_ccs=True, use_mmap=touts.use_mmap, 
+                                                             columns=touts.columns, max_cached=touts.max_cached)
+            else:
+                self.output['tout_ccs'] = list(self.particle_history('tout_ccs'))
 
-            next_p = next_tout['mean_p'] 
+        return self.output['tout_ccs']
 
-            if(np.abs(current_p - next_p)/current_p < 1e-5 ):  # Beam drifting
+    @property
+    def s_ccs(self):
+        """ 
+        Distance traveled by the tout centroids (see particles.centroid_path_length), 
+        from the memoized tout stats. Cached until the output is replaced.
+        """
+        if('s_ccs' not in self.output):
+            keys = ['mean_x', 'mean_y', 'mean_z', 'mean_t', 'mean_p', 'mean_beta']
+            stats = self.stat(keys, data_type='tout')
+            self.output['s_ccs'] = centroid_path_length(*[stats[key] for key in keys])
 
-                beta = current_tout['mean_beta']
-                dt = next_tout['mean_t']-current_tout['mean_t']
-                ds = dt*beta*c
+        return self.output['s_ccs'].copy()
 
-            else:  # Assume straight line acceleration
+    def tout_stat_vs_s(self, key, s=None, n_points=None):
+        """ 
+        Interpolates tout stats for key onto s, a grid of distances along the centroid path (see s_ccs). 
+        By default s is a uniform grid of n_points (n_tout if not given) from the first to the last tout. 
 
-                dx = next_tout['mean_x'] - current_tout['mean_x']
-                dy = next_tout['mean_y'] - current_tout['mean_y']
-                dz = next_tout['mean_z'] - current_tout['mean_z']
+        Returns (s, values), where values is an array, or a dict of arrays if key is a list of keys.
+        """
+        s_ccs = self.s_ccs
 
-                ds = np.sqrt( dx**2 + dy**2 + dz**2 )
+        if(s is None):
+            s = np.linspace(s_ccs[0], s_ccs[-1], n_points or len(s_ccs))
 
-            s.append( s[-1] + ds )
+        stats = self.stat(key, data_type='tout')
 
-            current_tout = next_tout
+        if(isinstance(key, str)):
+            return s, np.interp(s, s_ccs, stats)
 
-        return np.array(s)
+        return s, {k:np.interp(s, s_ccs, v) for k, v in stats.items()}
     
     
     def tout_stat(self, key=None):
@@ -332,6 +486,26 @@ class GPT:
     def trajectory(self, pid, data_type='tout'):
 
         """ Returns a 3d particle trajectory for particle with id = pid """
+
+        histories = self.particle_histories([pid], data_type=data_type)
+
+        if(int(pid) not in histories):
+            return None
+
+        variables = ['x', 'y', 'z', 'px', 'py', 'pz', 't']
+   
+        return {var:histories[int(pid)][var] for var in variables}
+
+    def particle_histories(self, pids, data_type='tout'):
+
+        """ 
+        Returns the histories through the touts or screens of the particles with ids in pids, 
+        as a dict keyed by id (see particles.particle_histories).
+
+        With lazy output only these particles are read from the output file, 
+        the rest of the touts and screens are never loaded.
+        """
+
         if(data_type=='tout'):
             particle_groups = self.tout
         elif(data_type=='screen'):
@@ -339,22 +513,33 @@ class GPT:
         else:
             raise ValueError(f'GPT.trajectory got an unsupported data type = {data_type}.')
 
-        #for pg in particle_groups:
-        #    print(pg, pid in pg['id'])
-        pgs_with_pid = [pg for pg in particle_groups if(pid in pg['id'])]
+        # Touts in the reference frame only exist as converted ParticleGroups
+        from_file = isinstance(particle_groups, LazyParticleGroups) and not (self.ref_ccs and data_type=='tout')
 
-        if(len(pgs_with_pid)==0):
-            return None
+        if(from_file):
+            return particle_histories(particle_groups.gdffile, pids, data_type=data_type, blocks=particle_groups.blocks)
+        else:
+            return particle_group_histories(particle_groups, pids)
+    
+    def trajectories(self, data_type='tout', variables=['x', 'y', 'z', 'px', 'py', 'pz', 't'], memmap_dir=None):
 
-        variables = ['x', 'y', 'z', 'px', 'py', 'pz', 't']
-   
-        trajectory = {var:np.zeros( (len(pgs_with_pid),) ) for var in variables }    
+        """ 
+        Returns the trajectories of every particle through the 'tout', 'tout_ccs' or 'screen' groups 
+        as (n_particles x n_groups) arrays per variable, with the particle ids in 'id' and a 'mask' 
+        that is False where a particle is not in a group (see particles.particle_trajectories).
+
+        memmap_dir backs the arrays with .npy memory maps in that directory, for runs too large for memory.
+        """
 
-        for ii, pg in enumerate(pgs_with_pid):
-            for var in variables:
-                trajectory[var][ii] = pg[var][pg['id']==pid]
+        if(data_type not in ['tout', 'tout_ccs', 'screen']):
+            raise ValueError(f'GPT.trajectories got an unsupported data type = {data_type}.')
+
+        if(isinstance(self.output['particles'], LazyParticleGroups)):
+            particle_groups = getattr(self, data_type)
+        else:
+            particle_groups = self.particle_history(data_type)
 
-        return trajectory
+        return particle_trajectories(particle_groups, variables=variables, memmap_dir=memmap_dir)
     
     @property
     def fields(self):
@@ -362,14 +547,19 @@ class GPT:
             return self.output['fields']
    
 
-    def run(self, gpt_verbose=False):
+    def run(self, gpt_verbose=False, on_output=None, poll_interval=1.0):
 
-        """ performs a basic GPT simulation configured in the current GPT object """
+        """ 
+        performs a basic GPT simulation configured in the current GPT object 
+
+        If given, on_output(kind, particle_group) is called with each tout ('tout') and screen ('screen') 
+        as soon as GPT has written it, while GPT is still running. See run_gpt.
+        """
 
         if not self.configured:
             self.configure()
         #pass
-        self.run_gpt(verbose=self.verbose, timeout=self.timeout, gpt_verbose=gpt_verbose)
+        self.run_gpt(verbose=self.verbose, timeout=self.timeout, gpt_verbose=gpt_verbose, on_output=on_output, poll_interval=poll_interval)
 
         
     def get_run_script(self, write_to_path=True):
@@ -403,15 +593,99 @@ class GPT:
             outfile = tokens[0]+'.out.gdf'
         return os.path.join(path, outfile)
 
-    def run_gpt(self, verbose=False, parse_output=True, timeout=None, gpt_verbose=False):
+    def output_monitor(self, on_output):
+        """
+        Returns a Watcher monitor that follows the GPT output file while GPT runs and calls 
+        on_output(kind, particle_group) for each tout and screen once it is completely written.
+        Screens are reported in the order GPT writes them.
+        """
+        output_file = self.get_gpt_output_file()
+
+        # Don't pick up the output of a previous run
+        if(os.path.exists(output_file)):
+            os.remove(output_file)
+
+        tail = easygdf.GDFTail(output_file, columns=parsers.gdf_block_columns(self.columns))
+
+        def monitor(done):
+            for block in tail.poll(final=done):
+                particle_group = gdf_block_to_particle_group(block, ref_ccs=self.ref_ccs, columns=self.columns)
+                if(particle_group is not None):
+                    on_output(block.kind, particle_group)
+
+        return monitor
+
+    def run_gpt(self, verbose=False, parse_output=True, timeout=None, gpt_verbose=False, on_output=None, poll_interval=1.0):
         
-        """ RUN GPT and read in results """
+        """ 
+        RUN GPT and read in results 
+
+        on_output(kind, particle_group) is called for each tout and screen while GPT is still running, 
+        checking the output file every poll_interval seconds.
+        """
         self.vprint('GPT.run_gpt:')
 
         run_info = {}
         t1 = time()
         run_info['start_time'] = t1
 
+        runscript, monitor = self._prepare_run(on_output)
+
+        self.vprint(f'   Running with timeout = {self.timeout} sec.')
+        run_time, exception, log = tools.execute(runscript, 
+                                                 kill_msgs=self.kill_msgs, 
+                                                 timeout=timeout, 
+                                                 verbose=gpt_verbose,
+                                                 workdir=full_path(self.path),
+                                                 monitor=monitor,
+                                                 monitor_interval=poll_interval)
+
+        self._finish_run(run_info, exception, log, parse_output)
+
+    async def run_async(self, gpt_verbose=False, on_output=None, poll_interval=1.0):
+
+        """ 
+        Same as run, as a coroutine: GPT runs as an asyncio subprocess (see tools.execute_async), 
+        so many runs can be awaited together from one event loop:
+
+            await asyncio.gather(*[G.run_async() for G in gpt_objects])
+        """
+
+        if not self.configured:
+            self.configure()
+
+        await self.run_gpt_async(verbose=self.verbose, timeout=self.timeout, gpt_verbose=gpt_verbose, on_output=on_output, poll_interval=poll_interval)
+
+    async def run_gpt_async(self, verbose=False, parse_output=True, timeout=None, gpt_verbose=False, on_output=None, poll_interval=1.0):
+
+        """ 
+        Same as run_gpt, as a coroutine. The log is streamed and checked for kill_msgs 
+        without blocking the event loop, and GPT is killed if it runs longer than timeout. 
+        Writing the input files, on_output and loading the output run in worker threads (see tools.run_in_thread).
+        """
+        self.vprint('GPT.run_gpt_async:')
+
+        run_info = {}
+        t1 = time()
+        run_info['start_time'] = t1
+
+        runscript, monitor = await tools.run_in_thread(self._prepare_run, on_output)
+
+        self.vprint(f'   Running with timeout = {self.timeout} sec.')
+        run_time, exception, log = await tools.execute_async(runscript, 
+                                                             kill_msgs=self.kill_msgs, 
+                                                             timeout=timeout, 
+                                                             verbose=gpt_verbose,
+                                                             workdir=full_path(self.path),
+                                                             monitor=monitor,
+                                                             monitor_interval=poll_interval)
+
+        await tools.run_in_thread(self._finish_run, run_info, exception, log, parse_output)
+
+    def _prepare_run(self, on_output=None):
+
+        """ Writes the initial particles and input file, returns the run script and the output monitor for on_output """
+
         if self.initial_particles:
             fname = self.write_initial_particles() 
             #print(fname)
@@ -427,12 +701,20 @@ class GPT:
             
         runscript = self.get_run_script()
 
-        self.vprint(f'   Running with timeout = {self.timeout} sec.')
-        run_time, exception, log = tools.execute(runscript, 
-                                                 kill_msgs=self.kill_msgs, 
-                                                 timeout=timeout, 
-                                                 verbose=gpt_verbose,
-                                                 workdir=full_path(self.path))
+        if(on_output is not None):
+            monitor = self.output_monitor(on_output)
+        else:
+            monitor = None
+
+        return runscript, monitor
+
+    def _finish_run(self, run_info, exception, log, parse_output=True):
+
+        """ 
+        Records the outcome of a run in run_info, loads the output and adds run_info to it. 
+        After a failed run (exception set) the touts and screens GPT finished writing are loaded, 
+        see parsers.read_complete_gdf_file, and none if the file is missing or unreadable.
+        """
                 
         if(exception is not None):
             self.error=True
@@ -441,10 +723,23 @@ class GPT:
     
         self.log = log
                     
-        if parse_output:
+        if(parse_output and exception is None):
             self.load_output(file=self.get_gpt_output_file())
 
-        run_info['run_time'] = time() - t1
+        elif(parse_output):
+            # A run that failed or timed out may have left no output file, or one cut off in the middle of a block
+            self.clear_output_cache()
+            self.output.pop('tout_centroids', None)
+            try:
+                touts, screens, fields = parsers.read_complete_gdf_file(self.get_gpt_output_file(), load_fields=self.load_fields, columns=self.columns)
+            except Exception as ex:
+                self.vprint(f'   Could not load the output of the failed run: {ex}')
+                touts, screens, fields = [], [], []
+
+            particle_groups = raw_data_to_particle_groups(touts, screens, verbose=self.verbose)
+            self._set_particle_output(particle_groups[:len(touts)], particle_groups[len(touts):], fields)
+
+        run_info['run_time'] = time() - run_info['start_time']
         run_info['run_error'] = self.error
         self.vprint(f'   Run finished, total time ellapsed: {run_info["run_time"]:G} (sec)')
 
@@ -489,23 +784,49 @@ class GPT:
     def stat(self, key, data_type='all'):
         """
         Calculates any statistic that the ParticleGroup class can calculate, on all particle groups, or just touts, or screens
+
+        key can also be a list of keys, in which case a dict of arrays is returned. The statistics of all groups 
+        are computed together from the particle histories (see particles.particle_history_stats). 
+        With lazy output the groups are reduced a few at a time, so the whole output is never held in memory.
+
+        Results are memoized per data type and key in .output['stats'] until the output is replaced (see clear_output_cache).
         """
+        if(data_type not in ['all', 'tout', 'tout_ccs', 'screen']):
+            raise ValueError(f'Unsupported GPT data type: {data_type}')
+
+        keys = [key] if isinstance(key, str) else list(key)
+
         if(data_type=='all'):
-            particle_groups = self.output['particles']
+            touts, screens = self.stat(keys, data_type='tout'), self.stat(keys, data_type='screen')
+            stats = {k:np.concatenate([touts[k], screens[k]]) for k in keys}
 
-        elif(data_type=='tout'):
-            particle_groups = self.tout
+        else:
+            cached = self.output.setdefault('stats', {}).setdefault(data_type, {})
 
-        elif(data_type=='tout_ccs'):
-            particle_groups = self.tout_ccs
+            missing = [k for k in dict.fromkeys(keys) if k not in cached]
+            if(missing):
+                cached.update(self._compute_stats(missing, data_type))
 
-        elif(data_type=='screen'):
-            particle_groups = self.screen
+            stats = {k:cached[k].copy() for k in keys}
+
+        if(isinstance(key, str)):
+            return stats[key]
+
+        return stats
+
+    def _compute_stats(self, keys, data_type):
+        """ Computes the stats for keys of the 'tout', 'tout_ccs' or 'screen' groups, see stat """
+
+        if(isinstance(self.output['particles'], LazyParticleGroups)):
+            groups = getattr(self, data_type)
+            n = DEFAULT_MAX_CACHED_GROUPS
+            chunks = [particle_history_stats(ParticleHistory.from_particle_groups(groups[ii:ii+n]), keys) for ii in range(0, len(groups), n)]
+            stats = {k:np.concatenate([chunk[k] for chunk in chunks]) if chunks else np.zeros(0) for k in keys}
 
         else:
-            raise ValueError(f'Unsupported GPT data type: {data_type}')
+            stats = particle_history_stats(self.particle_history(data_type), keys)
 
-        return particle_stats(particle_groups, key)
+        return stats
     
     def units(self, key):
         """
@@ -524,7 +845,7 @@ class GPT:
         """ Write the initial particle data to file for use with GPT """
         if not fname:
             fname = os.path.join(self.path, 'gpt.particles.gdf')
-        self.initial_particles.write_gpt(fname, asci2gdf_bin='$ASCI2GDF_BIN', verbose=False)
+        write_particle_group_gdf(self.initial_particles, fname, verbose=False)
         self.vprint(f'   Initial {len(self.initial_particles["x"])} particles written to "{fname}"')
         return fname 
 
@@ -572,11 +893,13 @@ class GPT:
         
 
     
-    def archive(self, h5=None):
+    def archive(self, h5=None, include_stats=False):
         """
         Archive all data to an h5 handle or filename.
         
         If no file is given, a file based on the fingerprint will be created.
+
+        With include_stats the memoized stats (see stat) are archived too, and are restored by load_archive.
         
         """
         if not h5:
@@ -600,7 +923,7 @@ class GPT:
             self.initial_particles.write(g, name='initial_particles')        
         
         # All output
-        gpt.archive.write_output_h5(g, self.output, name='output')
+        gpt.archive.write_output_h5(g, self.output, name='output', include_stats=include_stats)
 
         return h5        
 
@@ -769,7 +1092,7 @@ def phase_gpt(G):
 
     phasing_particle_file = os.path.join(G.path, 'gpt_particles.phasing.gdf')
 
-    phasing_beam.write_gpt(phasing_particle_file, asci2gdf_bin='$ASCI2GDF_BIN', verbose=G.verbose)
+    write_particle_group_gdf(phasing_beam, phasing_particle_file, verbose=G.verbose)
 
     #write_gpt(phasing_beam, phasing_particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
     
@@ -800,11 +1123,13 @@ def run_gpt(settings=None,
             verbose=False,
             gpt_verbose=False,
             asci2gdf_bin='$ASCI2GDF_BIN',
-            kill_msgs=DEFAULT_KILL_MSGS):
+            kill_msgs=DEFAULT_KILL_MSGS,
+            n_cpu=1):
     """
     Run GPT. 
     
         settings: dict with keys that can appear in a GPT input file. 
+        n_cpu: number of cores GPT may use (its -j flag)
     """
     if verbose:
         print('run_gpt') 
@@ -823,6 +1148,7 @@ def run_gpt(settings=None,
         use_tempdir=use_tempdir,
         kill_msgs=kill_msgs,
         initial_particles=initial_particles,
+        n_cpu=n_cpu,
         )
     
     G.timeout=timeout
@@ -856,7 +1182,7 @@ def run_gpt(settings=None,
 
         phasing_particle_file = os.path.join(G.path, 'gpt_particles.phasing.gdf')
 
-        phasing_beam.write_gpt(phasing_particle_file, asci2gdf_bin=asci2gdf_bin, verbose=verbose)
+        write_particle_group_gdf(phasing_beam, phasing_particle_file, verbose=verbose)
 
         #write_gpt(phasing_beam, phasing_particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
     
@@ -879,6 +1205,110 @@ def run_gpt(settings=None,
     
     return G
 
+
+def run_gpt_many(settings_list, 
+                 initial_particles=None, 
+                 n_cpu=1, 
+                 max_cores=None, 
+                 workdir=None, 
+                 merit_f=None, 
+                 **kwargs):
+    """
+    Runs GPT for every settings dict in settings_list, in a pool of processes (see run_gpt).
+
+        initial_particles: one ParticleGroup for all jobs, or a list with one per job
+        n_cpu: number of cores for each GPT job (its -j flag), or a list with one per job
+        max_cores: number of cores the running jobs may use together, all of the machine's by default
+        workdir: if given, job ii runs in workdir/job_ii and its files are kept. 
+                 Otherwise each job runs in its own temporary directory.
+        merit_f: if given, merit_f(G) is returned for each job instead of the GPT object, 
+                 e.g. merit.default_gpt_merit. It must be picklable (a module level function).
+        kwargs: passed on to run_gpt
+
+    Jobs are started in order as soon as their cores fit in max_cores. A job needing more than 
+    max_cores runs on its own with max_cores. Returns one result per job, in the order of settings_list. 
+    A job that fails gives {'error':True, 'why_error':traceback} and the others carry on.
+    """
+
+    n_job = len(settings_list)
+
+    if(not isinstance(initial_particles, (list, tuple))):
+        initial_particles = [initial_particles]*n_job
+
+    if(isinstance(n_cpu, int)):
+        n_cpu = [n_cpu]*n_job
+
+    max_cores = max_cores or os.cpu_count() or 1
+    n_cpu = [max(1, min(n, max_cores)) for n in n_cpu]
+
+    jobs = []
+    for ii, settings in enumerate(settings_list):
+
+        job = dict(kwargs, settings=settings, initial_particles=initial_particles[ii], n_cpu=n_cpu[ii])
+
+        if(workdir):
+            job['workdir'] = os.path.join(full_path(workdir), f'job_{ii}')
+            job['use_tempdir'] = False
+            os.makedirs(job['workdir'], exist_ok=True)
+
+        jobs.append(job)
+
+    results = [None]*n_job
+
+    if(n_job==0):
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(n_job, max(1, max_cores//min(n_cpu)))) as pool:
+
+        running = {}
+        free_cores = max_cores
+        next_job = 0
+
+        while(next_job < n_job or running):
+
+            while(next_job < n_job and n_cpu[next_job] <= free_cores):
+                running[pool.submit(_run_gpt_job, jobs[next_job], merit_f)] = next_job
+                free_cores -= n_cpu[next_job]
+                next_job += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+
+                ii = running.pop(future)
+                free_cores += n_cpu[ii]
+
+                try:
+                    results[ii] = future.result()
+                except Exception:  # The worker died, or the result couldn't be sent back
+                    results[ii] = {'error':True, 'why_error':traceback.format_exc()}
+
+    return results
+
+
+def _run_gpt_job(job, merit_f=None):
+    """ Runs one job of run_gpt_many in a worker process """
+
+    try:
+        G = run_gpt(**job)
+
+        if(merit_f is not None):
+            return merit_f(G)
+
+        if(G.use_tempdir):
+            # The temporary directory goes away with the worker: send the output back in memory
+            if('particles' in G.output):
+                G.output['particles'] = list(G.output['particles'])
+
+            del G.tempdir
+            G.path = None
+            G.configured = False
+
+        return G
+
+    except Exception:
+        return {'error':True, 'why_error':traceback.format_exc()}
+
     
 
 
@@ -11,7 +11,7 @@ from distgen.tools import update_nested_dict, is_key_in_nested_dict
 
 from gpt.gpt_phasing import gpt_phasing
 
-from pmd_beamphysics.interfaces.gpt import write_gpt
+from gpt.particles import write_particle_group_gdf
 from pmd_beamphysics.particles import centroid, join_particle_groups
 
 from h5py import File
@@ -145,7 +145,7 @@ def phase_gpt_with_distgen(settings=None,
         else:
             os.remove(particle_file)
 
-    write_gpt(beam, particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
+    write_particle_group_gdf(beam, particle_file, verbose=verbose)
 
     if(verbose):
         print('\nAuto Phasing >------\n')
@@ -159,7 +159,7 @@ def phase_gpt_with_distgen(settings=None,
     phasing_beam = join_particle_groups(*[centroid_particle for ii in range(10)])
 
     #phasing_beam = get_distgen_beam_for_phasing(beam, n_particle=10, verbose=verbose)
-    write_gpt(phasing_beam, phasing_particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
+    write_particle_group_gdf(phasing_beam, phasing_particle_file, verbose=verbose)
     
     if(verbose):
         print('<**** Created initial distribution for phasing.\n')    
@@ -284,7 +284,7 @@ def run_gpt_with_distgen(settings=None,
         else:
             os.remove(particle_file)
 
-    write_gpt(beam, particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
+    write_particle_group_gdf(beam, particle_file, verbose=verbose)
 
     #print(beam['x'].mean())
     #print(beam['y'].mean())
@@ -308,7 +308,7 @@ def run_gpt_with_distgen(settings=None,
         phasing_beam = join_particle_groups(*[centroid_particle for ii in range(10)])
 
         #phasing_beam = get_distgen_beam_for_phasing(beam, n_particle=10, verbose=verbose)
-        write_gpt(phasing_beam, phasing_particle_file, verbose=verbose, asci2gdf_bin=asci2gdf_bin)
+        write_particle_group_gdf(phasing_beam, phasing_particle_file, verbose=verbose)
     
         if(verbose):
             print('<**** Created initial distribution for phasing.\n')    
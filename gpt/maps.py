@@ -6,6 +6,7 @@ import subprocess
 
 #from gpt import GPT
 from gpt import tools
+from gpt import easygdf
 from gpt.tools import cvector
 from gpt.tools import in_ecs
 from gpt.element import Element
@@ -67,18 +68,11 @@ def get_gdf_header(gdf_file, gdf2a_bin=os.path.expandvars('$GDF2A_BIN')):
 
     """Reads the header (column names) of gdf_file and returns them"""
 
-    assert os.path.exists(gdf2a_bin), f'The gdf2a binary "{gdf2a_bin}" does not exist.'
     assert os.path.exists(gdf_file), f'The gdf file "{gdf_file}" does not exist'
 
-    temp_ascii_file = f'{gdf_file}.temp.txt'
-    cmd = f'{gdf2a_bin} -o {temp_ascii_file} {gdf_file}'
-    subprocess.run(cmd, shell=True)
+    with open(gdf_file, 'rb') as fp:
+        columns = easygdf.load_array_names(fp)
 
-    with open(temp_ascii_file, 'r') as fp:
-        columns = fp.readline().split()
-
-    # cleanup    
-    os.remove(temp_ascii_file)
     return columns
 
 class GDFFieldMap(Element):
@@ -87,7 +81,7 @@ class GDFFieldMap(Element):
 
     def __init__(self, source_data_file, gdf2a_bin='$GDF2A_BIN', use_temp_file=True):
         
-        assert os.path.exists(tools.full_path(gdf2a_bin)), f'GDF2A binary does not exist: {gdf2a_bin}'  
+        # The map is read directly from the binary GDF file, gdf2a_bin and use_temp_file are no longer used
 
         self.source_data_file = tools.full_path(source_data_file)
         assert os.path.exists(self.source_data_file), f'Source GDF file {self.source_data_file} does not exist.' 
@@ -105,27 +99,11 @@ class GDFFieldMap(Element):
             
             self.source_data_file = temp_gdf_file            
           
-        if(use_temp_file):
-            temp_ascii_file = tempfile.NamedTemporaryFile().name + '.txt'
-        else:
-            temp_ascii_file = f'{self.source_data_file}.temp.txt'
+        with open(self.source_data_file, 'rb') as fp:
+            ndata = easygdf.load_arrays(fp)
 
-        cmd = f'{gdf2a_bin} -o {temp_ascii_file} "{self.source_data_file}"' 
-        
-        subprocess.run(cmd, shell=True)
-
-        with open(temp_ascii_file, 'r') as fp:
-            for i, line in enumerate(fp):
-                if 'warning' in line.lower():
-                    print(f'warning found in {temp_ascii_file}', line )
-                else:
-                    column_names = line.split()
-                    break
-        n_header = i+1
+        column_names = list(ndata)
         self.column_names = column_names
-        ndata = np.loadtxt(temp_ascii_file, skiprows=n_header)
-
-        os.remove(temp_ascii_file)
         
         if(remove_temp_gdf):
             os.remove(temp_gdf_file)
@@ -147,18 +125,16 @@ class GDFFieldMap(Element):
         # Get the coordinate vectors:
         for var in self.coordinates:
  
-            v0 = ndata[0, column_names.index(var)]
-            for ii, v in enumerate(ndata[:, column_names.index(var)]):
-                if(v!=v0):
-                    coordinate_count_step[var] = ii
-                    break
-
-            value = ndata[:, column_names.index(var)] 
-            #setattr(self, var, value ) 
-            #setattr(self, var, value)
+            value = ndata[var] 
+
+            # Index of the first value that differs from the first one
+            changes = np.flatnonzero(value != value[0])
+            if(len(changes)>0):
+                coordinate_count_step[var] = changes[0]
+
             self.data[var]=value
 
-            coordinate_sizes[var] = len(np.unique(ndata[:, column_names.index(var)]))
+            coordinate_sizes[var] = len(np.unique(value))
 
         coordinate_names = list(coordinate_count_step.keys())
         coordinate_steps = list(coordinate_count_step.values())
@@ -173,8 +149,7 @@ class GDFFieldMap(Element):
         self.data_shape = data_shape
 
         for component in self.field_components:
-            #setattr(self, component, ndata[:,column_names.index(component)])
-            self.data[component]=ndata[:,column_names.index(component)]
+            self.data[component]=ndata[component]
 
     def __getitem__(self, key):
 
@@ -213,37 +188,15 @@ class GDFFieldMap(Element):
 
     def write_gdf(self, new_gdf_file, asci2gdf_bin='$ASCI2GDF_BIN', verbose=True):
 
-        """ Writes a new GDF file"""
-
-        temp_ascii_file = new_gdf_file + '.txt'
-
-        data = np.zeros( (len(self.data[self.field_components[0]]), len(self.column_names)) )
-
-        headers = []
-        for ii, var in enumerate(self.coordinates+self.field_components):
-            headers.append(var)
-
-            #data[:,ii] = getattr(self, self.column_names[var])
-            data[:,ii] = self.data[var]
-
-        headers = '     '.join(headers)
-        #np.savetxt(temp_ascii_file, data, header=headers, comments=' ')
-
+        """ 
+        Writes a new GDF file. The file is written directly from the data arrays, 
+        asci2gdf_bin is no longer used and kept for backwards compatibility.
+        """
 
-        # Write file. 
-        # Hack to delete final newline
-        # https://stackoverflow.com/questions/28492954/numpy-savetxt-stop-newline-on-final-line
-        with open(temp_ascii_file, 'w') as fout:
-            #print('wooot', temp_ascii_file)
-            NEWLINE_SIZE_IN_BYTES = 1 # 2 on Windows?
-            np.savetxt(fout, data, header=headers, comments='')
-            fout.seek(0, os.SEEK_END) # Go to the end of the file.
-            # Go backwards one byte from the end of the file.
-            fout.seek(fout.tell() - NEWLINE_SIZE_IN_BYTES, os.SEEK_SET)
-            fout.truncate() # Truncate the file to this point. 
+        data = {var:self.data[var] for var in self.coordinates+self.field_components}
 
-        subprocess.run(f'{asci2gdf_bin} -o {new_gdf_file} {temp_ascii_file}', shell=True)
-        os.remove(temp_ascii_file)
+        with open(new_gdf_file, 'wb') as fout:
+            easygdf.save_dict(fout, data)
 
     def gpt_label_to_fieldmap_label(self, name):
 
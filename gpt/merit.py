@@ -1,4 +1,5 @@
 from .parsers import read_particle_gdf_file
+from .particles import particle_stats
 import numpy as np
 import os
           
@@ -45,8 +46,6 @@ def default_gpt_merit(G):
         # Load final screen for calc
         if(len(G.screen)>0):
 
-            screen = G.screen[-1]   # Get data on last screen
-
             cartesian_coordinates = ['x', 'y', 'z']
             cylindrical_coordinates = ['r', 'theta']
             all_coordinates = cartesian_coordinates + cylindrical_coordinates
@@ -65,13 +64,17 @@ def default_gpt_merit(G):
                 for stat in stats:
                     keys.append(f'{stat}_{var}')
 
+            # All stats of the final screen in one batched pass (see particle_stats), 
+            # which is the only screen decoded with lazy output
+            screen_stats = particle_stats([G.screen[-1]], keys + ['mean_z', 'charge'])
+
             for key in keys:
-                m[f'end_{key}']=screen[key]
+                m[f'end_{key}']=screen_stats[key][0]
 
             # Extras
-            m['end_z_screen']=screen['mean_z']
+            m['end_z_screen']=screen_stats['mean_z'][0]
             m['end_n_particle_loss'] = start_n_particle - m['end_n_particle']
-            m['end_total_charge'] = screen['charge']
+            m['end_total_charge'] = screen_stats['charge'][0]
 
             # Basic Custom paramters:
             m['end_max[sigma_x, sigma_y]'] = max([m['end_sigma_x'], m['end_sigma_y']])
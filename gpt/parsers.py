@@ -222,7 +222,58 @@ def read_particle_gdf_file(gdffile, verbose=0.0, extra_screen_keys=['q','nmacro'
 
     return screen
 
-def read_gdf_file(gdffile, verbose=False, load_fields=False):
+# Field values at the particles, written to touts when GPT is asked for them
+FIELD_COLUMNS = ['fEx', 'fEy', 'fEz', 'fBx', 'fBy', 'fBz']
+
+# Arrays GPT only writes to touts
+TOUT_ONLY_COLUMNS = ['rxy'] + FIELD_COLUMNS
+
+def gdf_columns(columns=None, load_fields=False, kind='tout'):
+    """
+    Returns the extra GDF arrays read with each tout (kind='tout') or screen (kind='screen') beyond the phase space coordinates.
+
+    q, nmacro, ID and m are always read since the weights, species and particle ids depend on them. 
+    columns lists any other arrays wanted, or is a dict of such lists keyed by 'tout' and 'screen'. 
+    A plain list is used for both kinds of block, less the arrays screens do not have (TOUT_ONLY_COLUMNS). 
+    The field arrays are added to touts if load_fields. Every array not listed is skipped over in the file rather than read.
+    """
+
+    if(isinstance(columns, dict)):
+        columns = columns.get(kind)
+    elif(columns is not None and kind=='screen'):
+        columns = [key for key in columns if key not in TOUT_ONLY_COLUMNS]
+
+    if(columns is None):
+        columns = []
+
+    keys = ['q', 'nmacro', 'ID'] + [key for key in columns if key not in ['q', 'nmacro', 'ID', 'm'] + FIELD_COLUMNS] + ['m']
+
+    if(load_fields and kind=='tout'):
+        keys = keys + FIELD_COLUMNS
+
+    return keys
+
+
+def gdf_block_columns(columns=None, load_fields=False):
+    """
+    Returns the arrays to read from touts and screens as the dict used by easygdf.iter_blocks and easygdf.GDFTail
+    """
+    return {'tout':easygdf.TOUT_KEYS+gdf_columns(columns, load_fields=load_fields), 
+            'screen':easygdf.SCREEN_KEYS+gdf_columns(columns, kind='screen')}
+
+
+def read_gdf_file(gdffile, verbose=False, load_fields=False, use_mmap=False, use_index=False, columns=None, max_workers=None):
+    """
+    Reads the touts and screens from a GPT output gdf file. 
+
+    With use_index=True the file's table of contents is cached in a sidecar file (see easygdf.load_index),
+    so loading the same file again skips the scan for the tout and screen headers.
+
+    columns selects the optional particle arrays to read, see gdf_columns. 
+
+    With max_workers set, the touts and screens are decoded and turned into dicts by a pool of that many 
+    threads (see easygdf.map_blocks) and put back in file order, giving the same output as the serial read.
+    """
       
     # Read in file:
 
@@ -230,14 +281,27 @@ def read_gdf_file(gdffile, verbose=False, load_fields=False):
     #self.vprint("Current file: '"+data_file+"'",1,True)
     #self.vprint("Reading data...",1,False)
     t1 = time.time()
+
+    if(use_index):
+        index = easygdf.load_index(gdffile)
+    else:
+        index = None
+
+    if(max_workers is not None):
+
+        tdata, pdata, fields = read_gdf_file_threaded(gdffile, load_fields=load_fields, index=index, columns=columns, max_workers=max_workers)
+
+        if(verbose):
+            print(f'   GDF data loaded, time ellapsed: {time.time()-t1:G} (sec).')
+
+        return (tdata, pdata, fields)
+
     with open(gdffile, 'rb') as f:
         
-        if(load_fields):
-            extra_tout_keys   = ['q', 'nmacro', 'ID', 'm', 'fEx', 'fEy', 'fEz', 'fBx', 'fBy', 'fBz']
-        else:
-            extra_tout_keys   = ['q', 'nmacro', 'ID', 'm']
+        extra_tout_keys = gdf_columns(columns, load_fields=load_fields)
+        extra_screen_keys = gdf_columns(columns, kind='screen')
         
-        touts, screens = easygdf.load(f, extra_screen_keys=['q','nmacro', 'ID', 'm'], extra_tout_keys=extra_tout_keys)
+        touts, screens = easygdf.load(f, extra_screen_keys=extra_screen_keys, extra_tout_keys=extra_tout_keys, use_mmap=use_mmap, index=index)
         
     t2 = time.time()
     if(verbose):
@@ -245,54 +309,323 @@ def read_gdf_file(gdffile, verbose=False, load_fields=False):
             
     #self.vprint("Saving wcs tout and ccs screen data structures...",1,False)
 
-    tdata, fields = make_tout_dict(touts, load_fields=load_fields)
-    pdata = make_screen_dict(screens)
+    tdata, fields = make_tout_dict(touts, load_fields=load_fields, columns=columns)
+    pdata = make_screen_dict(screens, columns=columns)
+
+    return (tdata, pdata, fields)
+
+
+def read_gdf_file_threaded(gdffile, load_fields=False, index=None, columns=None, max_workers=None):
+    """
+    Does the work of read_gdf_file with a pool of max_workers threads. Each tout or screen is read and 
+    turned into its dict by a worker, then the results are put back together in file order and numbered, 
+    and the screens sorted by time, exactly as make_tout_dict and make_screen_dict do for the whole file.
+    """
+
+    if(index is None):
+        index = easygdf.load_index(gdffile, cache=False)
+
+    def decode(block, arrays):
+
+        record = easygdf.GDFBlock(block['kind'], block['value'], arrays)
+
+        if(block['kind']=='tout'):
+            return make_tout_dict([record], load_fields=load_fields, columns=columns)
+        else:
+            return (make_screen_dict([record], columns=columns), None)
+
+    with open(gdffile, 'rb') as f:
+        results = easygdf.map_blocks(f, index, decode, keys=gdf_block_columns(columns, load_fields=load_fields), max_workers=max_workers)
+
+    tdata, fields, pdata = [], [], []
+    for block, (data, field) in zip(index, results):
+        if(block['kind']=='tout'):
+            tdata.extend(data)
+            fields.extend(field)
+        else:
+            pdata.extend(data)
+
+    for count, tout in enumerate(tdata):
+        tout['number'] = count
+
+    for count, screen in enumerate(pdata):
+        screen['number'] = count
+
+    ts = np.array([screen['time'] for screen in pdata])
+    sorted_indices = np.argsort(ts)
+
+    return (tdata, [pdata[sii] for sii in sorted_indices], fields)
+
+
+def read_complete_gdf_file(gdffile, load_fields=False, columns=None):
+    """
+    Reads the touts and screens of a GPT output gdf file that may have been cut off, as read_gdf_file does, 
+    e.g. the output of a run that was killed. Only the touts and screens whose end marker is in the file are read 
+    (see easygdf.GDFTail), and a missing file has none.
+    """
+
+    blocks = easygdf.GDFTail(gdffile, columns=gdf_block_columns(columns, load_fields=load_fields)).poll()
+
+    tdata, fields = make_tout_dict(blocks, load_fields=load_fields, columns=columns)
+    pdata = make_screen_dict(blocks, columns=columns)
 
     return (tdata, pdata, fields)
 
 
 
 
-def make_tout_dict(touts, load_fields=False):
+def iter_gdf_file(gdffile, load_fields=False, use_mmap=False, use_index=False, columns=None):
+    """
+    Streams a GPT output gdf file one tout or screen at a time, yielding the tuples
+
+        ('tout', tout, field) or ('screen', screen, None)
+
+    in file order, where tout and screen are the dicts made by make_tout_dict and make_screen_dict.
+    Only one block is held in memory at a time. Unlike read_gdf_file, screens are not sorted by time.
+    """
+
+    if(use_index):
+        index = easygdf.load_index(gdffile)
+    else:
+        index = None
+
+    block_columns = gdf_block_columns(columns, load_fields=load_fields)
+
+    n_tout = 0
+    n_screen = 0
+
+    with open(gdffile, 'rb') as f:
+        for block in easygdf.iter_blocks(f, columns=block_columns, use_mmap=use_mmap, index=index):
+
+            if(block.kind=='tout'):
+
+                tdata, fields = make_tout_dict([block], load_fields=load_fields, columns=columns)
+
+                if(len(tdata)>0):
+                    tdata[0]['number'] = n_tout
+                    n_tout = n_tout+1
+                    yield ('tout', tdata[0], fields[0])
+
+            else:
+
+                pdata = make_screen_dict([block], columns=columns)
+
+                if(len(pdata)>0):
+                    pdata[0]['number'] = n_screen
+                    n_screen = n_screen+1
+                    yield ('screen', pdata[0], None)
+
+
+def read_gdf_blocks(gdffile, use_index=False):
+    """
+    Returns the table of contents entries (see easygdf.build_index) of the non-empty touts and screens in 
+    a GPT output gdf file, ordered the same way read_gdf_file orders its output: touts in file order, 
+    screens by their weighted mean time. 
+
+    Only the t, q, nmacro and m arrays of the screens are read to find that order. 
+    """
+
+    index = easygdf.load_index(gdffile, cache=use_index)
+
+    tout_blocks = [block for block in index if block['kind']=='tout' and block['n']>0]
+    screen_blocks = [block for block in index if block['kind']=='screen' and block['n']>0]
+
+    ts = []
+    with open(gdffile, 'rb') as f:
+        for block in screen_blocks:
+
+            data = easygdf.read_block(f, block, keys=['t', 'q', 'nmacro', 'm'])
+
+            _, _, weighted_time = weights_gamma_time(data['q'], data['nmacro'], data['m'], data['t'])
+
+            ts.append(weighted_time)
+
+    sorted_indices = np.argsort(ts)
+
+    return tout_blocks, [screen_blocks[sii] for sii in sorted_indices]
+
+
+def read_gdf_particles_by_id(gdffile, ids, data_type='tout', use_index=False, blocks=None):
+    """
+    Reads only the particles whose ID is in ids from the touts (data_type='tout') or screens ('screen')
+    of a GPT output gdf file, taken in the same order as read_gdf_file.
+
+    The ID column of every block is read first. The other columns are memory mapped and only 
+    indexed at the matching particles, so only the pages of the file holding them are read.
+
+    Returns a dict of arrays with one entry per particle found in each block:
+    'ID', 'x', 'GBx', 'y', 'GBy', 'z', 'GBz', 't', 'q', 'nmacro', 'm', and 'number', 
+    the position of the block among the touts or screens.
+
+    blocks can give the table of contents entries to search directly (see read_gdf_blocks), 
+    which skips finding the touts or screens in the file.
+    """
+
+    if(blocks is None):
+
+        tout_blocks, screen_blocks = read_gdf_blocks(gdffile, use_index=use_index)
+
+        if(data_type=='tout'):
+            blocks = tout_blocks
+        elif(data_type=='screen'):
+            blocks = screen_blocks
+        else:
+            raise ValueError(f'Unsupported data type = {data_type}.')
+
+    ids = np.unique(ids)
+    keys = ['ID', 'x', 'Bx', 'y', 'By', 'z', 'Bz', 'G', 't', 'q', 'nmacro', 'm']
+
+    def select(block, arrays):
+
+        rows = np.flatnonzero(np.isin(arrays['ID'], ids))
+
+        data = {key:np.asarray(arrays[key][rows], dtype=float) for key in arrays}
+        for key in ['x', 'y', 'z']:
+            data['GB'+key] = data.pop('B'+key)*data['G']
+
+        if(block['kind']=='tout'):
+            data['t'] = np.full(len(rows), block['value'])
+
+        return data
+
+    with open(gdffile, 'rb') as f:
+        selected = easygdf.map_blocks(f, blocks, select, keys=keys, compact=True)
+
+    names = ['ID', 'x', 'GBx', 'y', 'GBy', 'z', 'GBz', 't', 'q', 'nmacro', 'm']
+
+    particles = {name:np.concatenate([data[name] for data in selected] + [np.zeros(0)]) for name in names}
+    particles['number'] = np.concatenate([np.full(len(data['ID']), ii) for ii, data in enumerate(selected)] + [np.zeros(0, dtype=int)])
+
+    return particles
+
+
+def read_gdf_moments(gdffile, blocks, max_workers=None):
+    """
+    Returns the weighted centroids of the touts and screens of a GPT output gdf file given by 
+    their table of contents entries (see read_gdf_blocks), reading only the columns they need. 
+
+    The result is a dict of arrays with one entry per block: 
+    'time', 'mean_x', 'mean_y', 'mean_z', 'mean_GB' (mean |Beta*Gamma|), 'mean_beta', 'n', 
+    and 'm', 'q', the mass and charge of the first particle.
+    """
+
+    names = ['time', 'mean_x', 'mean_y', 'mean_z', 'mean_GB', 'mean_beta', 'n', 'm', 'q']
+
+    def moments(block, arrays):
+
+        if(block['kind']=='tout'):
+            t = np.full(len(arrays['x']), block['value'])
+        else:
+            t = arrays['t']
+
+        G = arrays['G']
+        GB = np.stack([arrays['Bx'], arrays['By'], arrays['Bz']])
+        GB *= G
+        GB = np.sqrt(np.einsum('ij,ij->j', GB, GB))
+
+        weights, _, weighted_time = weights_gamma_time(arrays['q'], arrays['nmacro'], arrays['m'], t)
+
+        return [weighted_time, np.dot(weights, arrays['x']), np.dot(weights, arrays['y']), np.dot(weights, arrays['z']),
+                np.dot(weights, GB), np.dot(weights, GB/G), len(G), arrays['m'][0], arrays['q'][0]]
+
+    keys = ['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G', 't', 'q', 'nmacro', 'm']
+
+    with open(gdffile, 'rb') as f:
+        rows = easygdf.map_blocks(f, blocks, moments, keys=keys, max_workers=max_workers)
+
+    return {name:np.array([row[ii] for row in rows]) for ii, name in enumerate(names)}
+
+
+def read_gdf_block(f, block, load_fields=False, use_mmap=False, columns=None):
+    """
+    Reads a single tout or screen dict, as made by make_tout_dict or make_screen_dict, from an open GPT 
+    output gdf file using its table of contents entry. For touts, returns the tuple (tout, field).
+    """
+
+    if(block['kind']=='tout'):
+
+        extra_keys = gdf_columns(columns, load_fields=load_fields)
+
+        touts, _ = easygdf.load(f, extra_tout_keys=extra_keys, use_mmap=use_mmap, index=[block])
+        tdata, fields = make_tout_dict(touts, load_fields=load_fields, columns=columns)
+
+        return tdata[0], fields[0]
+
+    else:
+
+        _, screens = easygdf.load(f, extra_screen_keys=gdf_columns(columns, kind='screen'), use_mmap=use_mmap, index=[block])
+
+        return make_screen_dict(screens, columns=columns)[0]
+
+
+def weights_gamma_time(q, nmacro, m, t, GB=None):
+    """
+    Per block kernel used when converting touts and screens. Returns the tuple (weights, gamma, time):
+
+        weights: |q*nmacro| normalized to sum to 1, or m normalized if there is no charge
+        gamma:   sqrt(1 + GBx^2 + GBy^2 + GBz^2), or None if GB is not given
+        time:    the weighted mean of t
+
+    GB is the (3, n) array of GBx, GBy, GBz and can be a strided view of the loader's phase space array.
+    Each output is computed in place in a single new buffer, with no temporary arrays and no copies of the inputs.
+    """
+
+    if(np.sum(q)==0 or np.sum(nmacro)==0):
+        weights = m/np.sum(m)  # Use the mass if no charge is specified
+    else:
+        weights = np.multiply(q, nmacro)
+        np.abs(weights, out=weights)
+        weights /= np.sum(weights)
+
+    if(GB is not None):
+        gamma = np.einsum('ij,ij->j', GB, GB)
+        gamma += 1
+        np.sqrt(gamma, out=gamma)
+    else:
+        gamma = None
+
+    return weights, gamma, np.dot(weights, t)
+
+
+def make_tout_dict(touts, load_fields=False, columns=None):
+
+    extra_keys = gdf_columns(columns, load_fields=load_fields)
+    keys = ['x', 'GBx', 'y', 'GBy', 'z', 'GBz', 't'] + extra_keys
 
     tdata=[]
     fields = []
     count = 0
     for data in touts:
+
+        if(isinstance(data, easygdf.GDFBlock)):  # Record from easygdf.iter_blocks
+            if(data.kind!='tout'):
+                continue
+            data = easygdf.make_phase_space_array(data, extra_keys)
+
         n=len(data[0,:])
         
         if(n>0):
 
-            q = data[7,:]       # elemental charge/macroparticle
-            nmacro = data[8,:]  # number of elemental charges/macroparticle
-                    
-            if(np.sum(q)==0 or np.sum(nmacro)==0):
-                weights = data[10,:]/np.sum(data[10,:])  # Use the mass if no charge is specified
-            else:
-                weights = np.abs(data[7,:]*data[8,:])/np.sum(np.abs(data[7,:]*data[8,:]))
-
-            tout = {"x":data[0,:],"GBx":data[1,:],
-                    "y":data[2,:],"GBy":data[3,:],
-                    "z":data[4,:],"GBz":data[5,:],
-                    "t":data[6,:],
-                    "q":data[7,:],
-                    "nmacro":data[8,:],
-                    "ID":data[9,:],
-                    "m":data[10,:],
-                    "w":weights,
-                    "G":np.sqrt(data[1,:]*data[1,:]+data[3,:]*data[3,:]+data[5,:]*data[5,:]+1)}
+            rows = {key:data[ii,:] for ii, key in enumerate(keys)}
+
+            # GBx, GBy, GBz are rows 1, 3, 5: a strided view, not a copy
+            weights, gamma, weighted_time = weights_gamma_time(rows['q'], rows['nmacro'], rows['m'], rows['t'], GB=data[1:6:2])
+
+            tout = {key:value for key, value in rows.items() if key not in FIELD_COLUMNS}
+            tout["w"]=weights
+            tout["G"]=gamma
 
             #tout["Bx"]=tout["GBx"]/tout["G"]
             #tout["By"]=tout["GBy"]/tout["G"]
             #tout["Bz"]=tout["GBz"]/tout["G"]
 
-            tout["time"]=np.sum(tout["w"]*tout["t"])
+            tout["time"]=weighted_time
             tout["n"]=len(tout["x"])
             tout["number"]=count
             
             if(load_fields):
-                field = {'Ex':data[11,:], 'Ey':data[12,:], 'Ez':data[13,:],
-                         'Bx':data[14,:], 'By':data[15,:], 'Bz':data[16,:]}
+                field = {'Ex':rows['fEx'], 'Ey':rows['fEy'], 'Ez':rows['fEz'],
+                         'Bx':rows['fBx'], 'By':rows['fBy'], 'Bz':rows['fBz']}
             else:
                 field=None
             
@@ -303,39 +636,37 @@ def make_tout_dict(touts, load_fields=False):
 
     return tdata, fields
 
-def make_screen_dict(screens):
+def make_screen_dict(screens, columns=None):
+
+    extra_keys = gdf_columns(columns, kind='screen')
+    keys = ['x', 'GBx', 'y', 'GBy', 'z', 'GBz', 't'] + extra_keys
 
     pdata=[]
          
     count=0
     for data in screens:
+
+        if(isinstance(data, easygdf.GDFBlock)):  # Record from easygdf.iter_blocks
+            if(data.kind!='screen'):
+                continue
+            data = easygdf.make_phase_space_array(data, extra_keys)
+
         n = len(data[0,:])
         if(n>0):
 
-            q = data[7,:]          # elemental charge/macroparticle
-            nmacro = data[8,:]     # number of elemental charges/macroparticle
-                   
-            if(np.sum(q)==0 or np.sum(nmacro)==0):
-                weights = data[10,:]/np.sum(data[10,:])  # Use the mass if no charge is specified
-            else:
-                weights = np.abs(data[7,:]*data[8,:])/np.sum(np.abs(data[7,:]*data[8,:]))
-
-            screen = {"x":data[0,:],"GBx":data[1,:],
-                      "y":data[2,:],"GBy":data[3,:],
-                      "z":data[4,:],"GBz":data[5,:],
-                      "t":data[6,:],
-                      "q":data[7,:],
-                      "nmacro":data[8,:],
-                      "ID":data[9,:],
-                      "m":data[10,:],
-                      "w":weights,
-                      "G":np.sqrt(data[1,:]*data[1,:]+data[3,:]*data[3,:]+data[5,:]*data[5,:]+1)}
+            rows = {key:data[ii,:] for ii, key in enumerate(keys)}
+
+            weights, gamma, weighted_time = weights_gamma_time(rows['q'], rows['nmacro'], rows['m'], rows['t'], GB=data[1:6:2])
+
+            screen = dict(rows)
+            screen["w"]=weights
+            screen["G"]=gamma
                 
                     #screen["Bx"]=screen["GBx"]/screen["G"]
                     #screen["By"]=screen["GBy"]/screen["G"]
                     #screen["Bz"]=screen["GBz"]/screen["G"]
 
-            screen["time"]=np.sum(screen["w"]*screen["t"])
+            screen["time"]=weighted_time
             screen["n"]=n
             screen["number"]=count
 
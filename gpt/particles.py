@@ -5,11 +5,30 @@ from pmd_beamphysics.species import mass_of
 from scipy.constants import physical_constants
 
 
-from gpt.tools import transform_to_centroid_coordinates
 import numpy as np
 
+from collections import OrderedDict
+from functools import lru_cache
+from collections.abc import Sequence
+import h5py
+import json
+import os
+
 from gpt.parsers import read_gdf_file
+from gpt.parsers import read_gdf_block
+from gpt.parsers import iter_gdf_file
+from gpt.parsers import make_tout_dict, make_screen_dict
 from gpt.parsers import read_particle_gdf_file
+from gpt.parsers import read_gdf_particles_by_id
+from gpt.parsers import read_gdf_moments
+from gpt import easygdf
+
+# Number of decoded ParticleGroups a LazyParticleGroups keeps in memory
+DEFAULT_MAX_CACHED_GROUPS = 32
+
+# Layout of the converted particle cache written next to GDF files, bump when it changes
+PARTICLE_CACHE_VERSION = 2
+PARTICLE_CACHE_KEYS = ['x', 'px', 'y', 'py', 'z', 'pz', 't', 'status', 'weight', 'id']
 
 def identify_species(mass, charge):
     """
@@ -41,7 +60,23 @@ def identify_species(mass, charge):
         
     else:
         raise ValueError(f'Cannot identify species with mass {mass} and charge {charge}')
-   
+
+
+@lru_cache(maxsize=None)
+def species_lookup(mass, charge):
+    """
+    Memoized identify_species: returns (species, rest energy in eV) for a mass in kg and charge in C. 
+    Every tout and screen of a run has the same few (mass, charge) pairs, so each is only identified once.
+    """
+    species = identify_species(mass, charge)
+    return species, mass_of(species)
+
+
+def uniform_value(values, message):
+    """ Returns the value shared by all entries of values, checked in O(n) with min == max """
+    assert len(values) > 0 and values.min() == values.max(), message
+    return values[0]
+
 
 def raw_data_to_particle_data(gpt_output_dict, verbose=False):
 
@@ -53,14 +88,10 @@ def raw_data_to_particle_data(gpt_output_dict, verbose=False):
 
     n_particle = len(gpt_output_dict['x'])
      
-    masses = np.unique(gpt_output_dict['m'])
-    charges = np.unique(gpt_output_dict['q'])
-    assert len(masses) == 1, 'All masses must be the same.'
-    assert len(charges) == 1, 'All charges must be the same'
-    mass = masses[0]
-    charge = charges[0]
+    mass = uniform_value(gpt_output_dict['m'], 'All masses must be the same.')
+    charge = uniform_value(gpt_output_dict['q'], 'All charges must be the same')
 
-    species = identify_species(mass, charge)
+    species, mc = species_lookup(float(mass), float(charge))
     
     data['species'] = species
     data['n_particle'] = n_particle
@@ -74,7 +105,7 @@ def raw_data_to_particle_data(gpt_output_dict, verbose=False):
     #data['py'] = gpt_output_dict['GBy']*gpt_output_dict['m']*factor
     #data['pz'] = gpt_output_dict['GBz']*gpt_output_dict['m']*factor
 
-    mc = mass_of(species)  # Returns rest energy in eV, which corresponds to same numeric value of mc [eV/c] 
+    # mc is the rest energy in eV, which corresponds to same numeric value of mc [eV/c] 
 
     data['px'] = gpt_output_dict['GBx']*mc
     data['py'] = gpt_output_dict['GBy']*mc
@@ -86,7 +117,8 @@ def raw_data_to_particle_data(gpt_output_dict, verbose=False):
 
     #print(c_light, e_charge, gpt_output_dict['m'][0], m_e)
 
-    data['weight'] = abs(gpt_output_dict['q']*gpt_output_dict['nmacro'])
+    data['weight'] = np.multiply(gpt_output_dict['q'], gpt_output_dict['nmacro'])
+    np.abs(data['weight'], out=data['weight'])
 
     if( np.all(data['weight'] == 0.0) ):
         data['weight']= np.full(data['weight'].shape, 1/len(data['weight']))
@@ -103,34 +135,845 @@ def raw_data_to_particle_groups(touts, screens, verbose=False, ref_ccs=False):
     if(verbose):
         print('   Converting tout and screen data to ParticleGroup(s)')
 
+    # Species are resolved through species_lookup, so each (mass, charge) pair is identified once for the whole run
+    particle_groups = [ ParticleGroup(data=raw_data_to_particle_data(datum)) for datum in touts+screens ]
+
     if(ref_ccs):
+        particle_groups[:len(touts)] = transform_groups_to_centroid_coordinates(particle_groups[:len(touts)])
 
-        pg_touts = [ ParticleGroup(data=raw_data_to_particle_data(datum))  for datum in touts ]
-        pg_screens = [ ParticleGroup(data=raw_data_to_particle_data(datum))  for datum in screens ]
-        new_touts = [transform_to_centroid_coordinates(tout) for tout in pg_touts]
-        
-        return new_touts + pg_screens     
+    return particle_groups
 
-    else:
-        return [ ParticleGroup(data=raw_data_to_particle_data(datum))  for datum in touts+screens ] 
 
+class LazyParticleGroups(Sequence):
+    """
+    Read-only list of the tout and screen ParticleGroups in a GPT output gdf file, 
+    where each entry is only read from the file and converted when it is indexed.
+
+    blocks are the table of contents entries of the groups, in order (see parsers.read_gdf_blocks).
+    The max_cached most recently used ParticleGroups are kept in an LRU cache. Slicing returns 
+    another LazyParticleGroups sharing the same file and cache, so G.screen[-1] only decodes one screen.
+
+    The file is only opened while a group is read, so no handle is held between reads 
+    and the file must stay in place for as long as the groups are used. close() drops the decoded groups.
+    """
+
+    def __init__(self, gdffile, blocks, ref_ccs=False, use_mmap=False, columns=None, max_cached=DEFAULT_MAX_CACHED_GROUPS):
+
+        self.gdffile = gdffile
+        self.blocks = list(blocks)
+        self.ref_ccs = ref_ccs
+        self.use_mmap = use_mmap
+        self.columns = columns
+        self.max_cached = max_cached
+
+        self._cache = OrderedDict()
+
+    def _view(self, blocks):
+        """ New sequence over blocks sharing this one's file and cache """
+        view = LazyParticleGroups.__new__(LazyParticleGroups)
+        view.__dict__.update(self.__dict__)
+        view.blocks = blocks
+        return view
+
+    def _load(self, block):
+        """ Reads and converts one block """
+        with open(self.gdffile, 'rb') as f:
+            if(block['kind']=='tout'):
+                datum, _ = read_gdf_block(f, block, use_mmap=self.use_mmap, columns=self.columns)
+            else:
+                datum = read_gdf_block(f, block, use_mmap=self.use_mmap, columns=self.columns)
+
+            particle_group = ParticleGroup(data=raw_data_to_particle_data(datum))
+
+        if(self.ref_ccs and block['kind']=='tout'):
+            particle_group = transform_groups_to_centroid_coordinates([particle_group])[0]
+
+        return particle_group
+
+    def close(self):
+        """ Drops the decoded groups, shared with the slices of this sequence """
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, i):
+
+        if(isinstance(i, slice)):
+            return self._view(self.blocks[i])
+
+        block = self.blocks[i]
+        key = block['offset']
+
+        if(key in self._cache):
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        particle_group = self._load(block)
+
+        self._cache[key] = particle_group
+        if(len(self._cache) > self.max_cached):
+            self._cache.popitem(last=False)
+
+        return particle_group
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __deepcopy__(self, memo):
+        # The file contents never change, so copies read the same file but don't share the decoded groups
+        copied = self._view(list(self.blocks))
+        copied._cache = OrderedDict()
+        return copied
 
-def gdf_to_particle_groups(gdffile, verbose=False, load_fields=False):
+    def __reduce__(self):
+        # The file may not be reachable where this is unpickled: send the decoded groups instead
+        return (list, (list(self),))
+
+    def __repr__(self):
+        return f'<LazyParticleGroups of {len(self)} groups in {self.gdffile}, {len(self._cache)} cached>'
+
+
+def gdf_to_particle_groups(gdffile, verbose=False, load_fields=False, columns=None, max_workers=None, use_cache=False):
 
     """
     Read an output gdf file from GPT into a lists of tout and screen particle groups
+
+    With use_cache (and no load_fields), the converted groups are stored in a columnar cache file 
+    next to gdffile on the first call and read back from it while the gdf file is unchanged, 
+    see read_particle_cache.
     """
-    print(load_fields)
 
-    (tdata, pdata, fields) = read_gdf_file(gdffile, verbose=verbose, load_fields=load_fields)
+    if(use_cache and not load_fields):
+        cached = read_particle_cache(gdffile, columns=columns)
+        if(cached is not None):
+            touts, screens = cached
+            return (touts, screens, [None]*len(touts))
+
+    (tdata, pdata, fields) = read_gdf_file(gdffile, verbose=verbose, load_fields=load_fields, columns=columns, max_workers=max_workers)
 
     all_pgs = raw_data_to_particle_groups(tdata, pdata, verbose=verbose)
 
     touts = all_pgs[:len(tdata)]
     screens = all_pgs[len(tdata):]
 
+    if(use_cache and not load_fields):
+        write_particle_cache(gdffile, touts, screens, columns=columns)
+
     return (touts, screens, fields)
 
+
+def particle_histories(gdffile, ids, data_type='tout', use_index=False, blocks=None):
+    """
+    Returns the histories of the particles with the given ids through the touts (data_type='tout') 
+    or screens ('screen') of a GPT output gdf file, reading only those particles from the file 
+    (see parsers.read_gdf_particles_by_id).
+
+    The result is a dict keyed by particle id. Each history is a dict of the arrays 
+    'x', 'y', 'z', 'px', 'py', 'pz', 't' in ParticleGroup units, with one entry per tout or screen 
+    the particle is in, and 'index', the positions of those touts or screens. 
+    Particles that are never found are left out.
+
+    blocks optionally gives the table of contents entries of the touts or screens to search.
+    """
+
+    raw = read_gdf_particles_by_id(gdffile, ids, data_type=data_type, use_index=use_index, blocks=blocks)
+
+    # Momenta use the rest energy of the species, as in raw_data_to_particle_data
+    mc = np.zeros(len(raw['ID']))
+    species = np.stack([raw['m'], raw['q']], axis=-1)
+    for mass, charge in np.unique(species, axis=0):
+        mc[(raw['m']==mass) & (raw['q']==charge)] = species_lookup(float(mass), float(charge))[1]
+
+    data = {'x':raw['x'], 'y':raw['y'], 'z':raw['z'], 
+            'px':raw['GBx']*mc, 'py':raw['GBy']*mc, 'pz':raw['GBz']*mc, 
+            't':raw['t']}
+
+    return split_particle_histories(raw['ID'], raw['number'], data)
+
+
+def particle_group_histories(particle_groups, ids):
+    """
+    Same as particle_histories, for a list of ParticleGroups already in memory.
+    """
+    
+    variables = ['x', 'y', 'z', 'px', 'py', 'pz', 't']
+    ids = np.unique(ids)
+
+    found_ids, numbers, data = [], [], {var:[] for var in variables}
+    for ii, pg in enumerate(particle_groups):
+
+        rows = np.flatnonzero(np.isin(pg['id'], ids))
+        if(len(rows)==0):
+            continue
+
+        found_ids.append(pg['id'][rows])
+        numbers.append(np.full(len(rows), ii))
+        for var in variables:
+            data[var].append(pg[var][rows])
+
+    if(len(found_ids)==0):
+        return {}
+
+    return split_particle_histories(np.concatenate(found_ids), np.concatenate(numbers), {var:np.concatenate(data[var]) for var in variables})
+
+
+def split_particle_histories(ids, numbers, data):
+    """
+    Splits the rows of the arrays in data, taken from the touts or screens numbers, into one history per id.
+    """
+
+    order = np.lexsort((numbers, ids))
+    ids = ids[order]
+
+    unique_ids, starts = np.unique(ids, return_index=True)
+    stops = np.append(starts[1:], len(ids))
+
+    histories = {}
+    for pid, start, stop in zip(unique_ids, starts, stops):
+        rows = order[start:stop]
+        history = {var:value[rows] for var, value in data.items()}
+        history['index'] = numbers[rows]
+        histories[int(pid)] = history
+
+    return histories
+
+
+def particle_trajectories(particle_groups, variables=['x', 'y', 'z', 'px', 'py', 'pz', 't'], memmap_dir=None):
+    """
+    Pivots a sequence of ParticleGroups (a ParticleHistory, or e.g. GPT.tout) into one 
+    (n_particles x n_groups) array per variable, with a row per particle id: 
+
+        'id':   sorted particle ids, one per row
+        'mask': True where the particle is in the group. Lost particles are masked from the group they vanish in
+        var:    values of var, nan where masked
+
+    The rows are found with one sort-by-id join: the ids of all groups are sorted once 
+    and every particle is placed with np.searchsorted. Other sequences are copied into 
+    histories a few groups at a time, so lazy output is never held in memory all at once.
+
+    With memmap_dir the arrays are .npy memory maps in that directory (mask.npy, x.npy, ...), 
+    so the result can be larger than memory.
+    """
+
+    if(isinstance(particle_groups, ParticleHistory)):
+        chunks = lambda: [particle_groups]
+    else:
+        n = DEFAULT_MAX_CACHED_GROUPS
+        chunks = lambda: (ParticleHistory.from_particle_groups(particle_groups[ii:ii+n]) for ii in range(0, len(particle_groups), n))
+
+    ids = np.unique(np.concatenate([chunk['id'] for chunk in chunks()] + [np.zeros(0, dtype=int)]))
+    shape = (len(ids), len(particle_groups))
+
+    def allocate(name, dtype, fill):
+        if(memmap_dir is None):
+            return np.full(shape, fill, dtype=dtype)
+        array = np.lib.format.open_memmap(os.path.join(memmap_dir, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+        array[...] = fill
+        return array
+
+    trajectories = {'id':ids, 'mask':allocate('mask', bool, False)}
+    for var in variables:
+        trajectories[var] = allocate(var, float, np.nan)
+
+    start = 0
+    for chunk in chunks():
+
+        rows = np.searchsorted(ids, chunk['id'])
+        columns = start + chunk.group_index
+
+        trajectories['mask'][rows, columns] = True
+        for var in variables:
+            trajectories[var][rows, columns] = chunk[var]
+
+        start += len(chunk)
+
+    return trajectories
+
+
+def centroid_path_length(mean_x, mean_y, mean_z, mean_t, mean_p, mean_beta):
+    """
+    Distance traveled by the centroid of a sequence of touts, see GPT.s_ccs. 
+    The arguments are arrays of the tout stats of the same names. 
+
+    Between touts with the same momentum as the first the centroid drifts at its speed, 
+    otherwise it is taken to move in a straight line between the mean positions.
+    """
+
+    mean_x, mean_y, mean_z, mean_t, mean_p, mean_beta = [np.asarray(a, dtype=float) for a in [mean_x, mean_y, mean_z, mean_t, mean_p, mean_beta]]
+
+    if(len(mean_x)==0):
+        return np.zeros(0)
+
+    # Beam drifting, with the momentum compared to the first tout
+    drifting = np.abs(mean_p[0] - mean_p[1:])/mean_p[0] < 1e-5
+
+    ds_drift = np.diff(mean_t)*mean_beta[:-1]*c_light 
+    ds_straight = np.sqrt( np.diff(mean_x)**2 + np.diff(mean_y)**2 + np.diff(mean_z)**2 )  # Assume straight line acceleration
+
+    s0 = np.sqrt(mean_x[0]**2 + mean_y[0]**2 + mean_z[0]**2)
+
+    # Accumulating from s0 adds the steps in the same order as a running sum
+    return np.cumsum(np.concatenate([[s0], np.where(drifting, ds_drift, ds_straight)]))
+
+
+class Timeline:
+    """
+    Index over all of the touts and screens of a GPT run, in the order of GPT.particles. 
+    Each column is an array with one entry per tout or screen:
+
+        kind:   'tout' or 'screen'
+        time:   weighted mean time [s]
+        mean_z: weighted mean z [m]
+        s:      distance traveled by the centroid [m], see GPT.s_ccs. Screens are interpolated in time between touts.
+        n:      number of particles
+        offset: byte offset of the tout or screen in the gdf file, -1 if it was not read from a file
+
+    The queries return positions in GPT.particles, so only the matching groups need to be loaded:
+
+        G.particles[i] for i in G.timeline.between(t1, t2)
+        G.particles[G.timeline.nearest(3, key='mean_z')]
+    """
+
+    def __init__(self, kind, time, mean_z, s, n, offset):
+
+        self.kind = np.asarray(kind)
+        self.time = np.asarray(time, dtype=float)
+        self.mean_z = np.asarray(mean_z, dtype=float)
+        self.s = np.asarray(s, dtype=float)
+        self.n = np.asarray(n, dtype=int)
+        self.offset = np.asarray(offset, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __getitem__(self, i):
+        return {key:getattr(self, key)[i] for key in ['kind', 'time', 'mean_z', 's', 'n', 'offset']}
+
+    def _positions(self, kind):
+        """ Positions of the entries of kind ('tout', 'screen' or None for both) """
+        if(kind is None):
+            return np.arange(len(self))
+        return np.flatnonzero(self.kind==kind)
+
+    def between(self, low, high, key='time', kind=None):
+        """ Positions of the entries with low <= key <= high, in order of key. key is 'time', 'mean_z' or 's' """
+        positions = self._positions(kind)
+        values = getattr(self, key)[positions]
+        positions = positions[(values >= low) & (values <= high)]
+        return positions[np.argsort(getattr(self, key)[positions], kind='stable')]
+
+    def nearest(self, value, key='time', kind=None):
+        """ Position of the entry with key closest to value, or None if there are no entries """
+        positions = self._positions(kind)
+        if(len(positions)==0):
+            return None
+        return positions[np.argmin(np.abs(getattr(self, key)[positions] - value))]
+
+    def at_time(self, t, kind=None):
+        """ Position of the entry closest in time to t """
+        return self.nearest(t, key='time', kind=kind)
+
+    def at_z(self, z, kind=None):
+        """ Position of the entry with mean z closest to z """
+        return self.nearest(z, key='mean_z', kind=kind)
+
+    def at_s(self, s, kind=None):
+        """ Position of the entry closest to s along the centroid path """
+        return self.nearest(s, key='s', kind=kind)
+
+    def __repr__(self):
+        return f'<Timeline of {np.sum(self.kind=="tout")} touts and {np.sum(self.kind=="screen")} screens>'
+
+
+def make_timeline(kind, moments, offset):
+    """ 
+    Builds a Timeline from the per group moments: dict of arrays 
+    'time', 'mean_x', 'mean_y', 'mean_z', 'mean_p', 'mean_beta', 'n' 
+    """
+
+    kind = np.asarray(kind)
+    touts = kind=='tout'
+
+    s = np.full(len(kind), np.nan)
+    s[touts] = centroid_path_length(*[moments[key][touts] for key in ['mean_x', 'mean_y', 'mean_z', 'time', 'mean_p', 'mean_beta']])
+
+    if(np.any(touts)):
+        s[~touts] = np.interp(moments['time'][~touts], moments['time'][touts], s[touts])
+
+    return Timeline(kind, moments['time'], moments['mean_z'], s, moments['n'], offset)
+
+
+def gdf_timeline(gdffile, blocks, max_workers=None):
+    """
+    Timeline of the touts and screens of a GPT output gdf file given by their table of contents entries, 
+    in that order (see parsers.read_gdf_blocks). Only the columns needed for the centroids are read.
+    """
+
+    moments = read_gdf_moments(gdffile, blocks, max_workers=max_workers)
+
+    mc = np.array([species_lookup(float(m), float(q))[1] for m, q in zip(moments['m'], moments['q'])])
+    moments['mean_p'] = moments['mean_GB']*mc
+
+    return make_timeline([block['kind'] for block in blocks], moments, [block['offset'] for block in blocks])
+
+
+def particle_groups_timeline(particle_groups, n_tout, tout_centroids=None):
+    """
+    Timeline of a list of ParticleGroups already in memory, the first n_tout of which are touts.
+
+    For touts transformed to their centroid coordinate systems, whose mean positions are zero, 
+    tout_centroids gives the 'mean_x', 'mean_y' and 'mean_z' arrays of the touts before the transform. 
+    The other moments do not change under the transform.
+    """
+
+    keys = ['mean_x', 'mean_y', 'mean_z', 'mean_t', 'mean_p', 'mean_beta', 'n_particle']
+    moments = particle_stats(list(particle_groups), keys)
+
+    if(tout_centroids is not None):
+        for key in ['mean_x', 'mean_y', 'mean_z']:
+            moments[key][:n_tout] = tout_centroids[key]
+    moments['time'] = moments.pop('mean_t')
+    moments['n'] = moments.pop('n_particle')
+
+    kind = ['tout']*n_tout + ['screen']*(len(particle_groups)-n_tout)
+
+    return make_timeline(kind, moments, np.full(len(particle_groups), -1))
+
+
+def particle_group_view(data):
+    """
+    ParticleGroup that uses the arrays in data as they are, without the copy ParticleGroup(data=...) makes.
+    data has the ParticleGroup arrays ('x', 'px', ..., 'weight' and optionally 'id') and a scalar 'species'. 
+    Changing the arrays in place changes data, setting them (pg.x = ...) does not.
+
+    The group is built empty and its arrays are swapped into ParticleGroup.data, the dict the group reads them from, 
+    so id and status must already be integer arrays as ParticleGroup makes them. tests/test_particles.py checks this still holds.
+    """
+    empty = {key:np.zeros(0) for key in data}
+    empty['species'] = data['species']
+
+    particle_group = ParticleGroup(data=empty)
+    particle_group.data.update((key, data[key]) for key in particle_group.data)
+
+    return particle_group
+
+
+class ParticleHistory(Sequence):
+    """
+    A sequence of ParticleGroups (e.g. all touts of a run) stored as columns: 
+    each of PARTICLE_CACHE_KEYS is one array holding every group back to back, 
+    and group i is the slice offsets[i]:offsets[i+1] of every column.
+
+        history[i]        ParticleGroup view of group i (no copy)
+        history['x']      the whole x column
+        history.mean('x') weighted mean of x for every group, one vectorized pass over the column
+
+    The reductions take a column name or any array with one entry per particle 
+    and return an array with one entry per group (nan for empty groups).
+    """
+
+    def __init__(self, columns, offsets, species):
+
+        self.columns = columns
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.species = list(species)
+
+    @classmethod
+    def from_particle_groups(cls, particle_groups):
+        """ Copies a list (or any iterable) of ParticleGroups into a ParticleHistory """
+
+        particle_groups = list(particle_groups)
+
+        offsets = np.zeros(len(particle_groups)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(pg.x) for pg in particle_groups])
+
+        columns = {}
+        for key in PARTICLE_CACHE_KEYS:
+            if(len(particle_groups)>0):
+                # Attribute access skips the statistic key parsing of ParticleGroup.__getitem__
+                columns[key] = np.concatenate([getattr(pg, key) for pg in particle_groups])
+            else:
+                columns[key] = np.zeros(0)
+
+        return cls(columns, offsets, [pg.species for pg in particle_groups])
+
+    def __len__(self):
+        return len(self.species)
+
+    def __getitem__(self, key):
+
+        if(isinstance(key, str)):
+            return self.columns[key]
+
+        if(isinstance(key, slice)):
+            return [self[ii] for ii in range(len(self))[key]]
+
+        ii = range(len(self))[key]
+        start, stop = self.offsets[ii], self.offsets[ii+1]
+
+        data = {k:column[start:stop] for k, column in self.columns.items()}
+        data['species'] = self.species[ii]
+
+        return particle_group_view(data)
+
+    @property
+    def n_particle(self):
+        """ Number of particles in each group """
+        return np.diff(self.offsets)
+
+    @property
+    def group_index(self):
+        """ Index of the group of every particle """
+        return np.repeat(np.arange(len(self)), self.n_particle)
+
+    def _values(self, values):
+        """ Column named values, or values itself """
+        if(isinstance(values, str)):
+            return self.columns[values]
+        return np.asarray(values)
+
+    def reduce(self, ufunc, values, empty=np.nan):
+        """ Applies ufunc.reduce (e.g. np.add, np.maximum) to values over every group, empty groups give empty """
+
+        values = self._values(values)
+
+        n = self.n_particle
+        result = np.full(len(self), empty, dtype=np.result_type(values.dtype, type(empty)))
+
+        # Empty groups are skipped: the start of the next group ends the previous one
+        nonempty = n>0
+        if(np.any(nonempty)):
+            result[nonempty] = ufunc.reduceat(values, self.offsets[:-1][nonempty])
+
+        return result
+
+    def sum(self, values):
+        """ Sum of values over every group """
+        return self.reduce(np.add, values, empty=0.0)
+
+    def min(self, values):
+        """ Minimum of values over every group """
+        return self.reduce(np.minimum, values)
+
+    def max(self, values):
+        """ Maximum of values over every group """
+        return self.reduce(np.maximum, values)
+
+    def mean(self, values):
+        """ Weighted mean of values over every group """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(self._values(values)*self.columns['weight'])/self.sum('weight')
+
+    def broadcast(self, group_values):
+        """ Expands an array with one entry per group to one entry per particle """
+        return np.repeat(group_values, self.n_particle)
+
+    def __repr__(self):
+        return f'<ParticleHistory of {len(self)} groups and {self.offsets[-1]} particles>'
+
+
+def centroid_coordinates_history(history, e2=[0, 1, 0]):
+    """
+    ParticleHistory of every group of history in its own centroid coordinate system, 
+    as tools.transform_to_centroid_coordinates gives for a single group: positions are taken relative 
+    to the mean position, and positions and momenta are expressed in the basis e1 = e2 x e3, e2, e3 = <p>/|<p>|.
+
+    The bases of all groups are stacked and inverted in one call, then each group's slice of the columns is rotated 
+    by its matrix straight into the new columns, so only the new x, y, z, px, py, pz columns are allocated for the whole history. 
+    The t, status, weight and id columns are shared with history.
+    """
+
+    mean_r = np.stack([history.mean(name) for name in ['x', 'y', 'z']], axis=-1)
+    mean_p = np.stack([history.mean(name) for name in ['px', 'py', 'pz']], axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        e3 = mean_p/np.linalg.norm(mean_p, axis=-1, keepdims=True)
+
+    e2 = np.broadcast_to(np.asarray(e2, dtype=float), e3.shape)
+    e1 = np.cross(e2, e3)
+
+    # Inverse of the matrix with columns e1, e2, e3, for every group
+    M = np.linalg.inv(np.stack([e1, e2, e3], axis=-1))
+
+    new_r = np.empty((3, history.offsets[-1]))
+    new_p = np.empty((3, history.offsets[-1]))
+
+    for ii, (start, stop) in enumerate(zip(history.offsets[:-1], history.offsets[1:])):
+        if(start==stop):
+            continue
+
+        r = np.stack([history[name][start:stop] for name in ['x', 'y', 'z']])
+        r -= mean_r[ii][:, None]
+        np.matmul(M[ii], r, out=new_r[:, start:stop])
+
+        p = np.stack([history[name][start:stop] for name in ['px', 'py', 'pz']])
+        np.matmul(M[ii], p, out=new_p[:, start:stop])
+
+    columns = dict(history.columns)
+    for ii, name in enumerate(['x', 'y', 'z']):
+        columns[name] = new_r[ii]
+        columns['p'+name] = new_p[ii]
+
+    return ParticleHistory(columns, history.offsets, history.species)
+
+
+def transform_groups_to_centroid_coordinates(particle_groups):
+    """ The ParticleGroups transformed to their centroid coordinate systems together, see centroid_coordinates_history """
+    return list(centroid_coordinates_history(ParticleHistory.from_particle_groups(particle_groups)))
+
+
+# Statistics particle_history_stats computes in one pass over the columns, other keys are computed per group
+HISTORY_STAT_OPERATORS = ['mean', 'sigma', 'min', 'max', 'ptp']
+HISTORY_STAT_VARIABLES = PARTICLE_CACHE_KEYS + ['p', 'energy', 'kinetic_energy', 'gamma', 'beta', 'beta_x', 'beta_y', 'beta_z', 'r', 'theta', 'pr', 'ptheta', 'xp', 'yp']
+
+
+def particle_history_stats(history, keys):
+    """
+    Statistics of every group of a ParticleHistory, as a dict of arrays with one entry per group keyed by stat name. 
+    Gives the same values as [pg[key] for pg in history], but the common keys are computed for all groups at once:
+
+        mean_, sigma_, min_, max_, ptp_ of the columns and of 'p', 'energy', 'kinetic_energy', 
+        'gamma', 'beta', 'beta_x', 'beta_y', 'beta_z', 'r', 'theta', 'pr', 'ptheta', 'xp', 'yp'
+        cov_a__b, norm_emit_x, norm_emit_y, norm_emit_4d
+        n_particle, n_alive, charge
+
+    Weighted moments follow ParticleGroup: means and sigmas are weighted averages, covariances 
+    (and so emittances) use the reliability weighted estimate of np.cov(..., aweights=weight). 
+    Any other key ParticleGroup understands is computed group by group on views of the history.
+    """
+
+    weight = history['weight']
+    sum_weight = history.sum(weight)
+
+    mc = np.array([mass_of(species) for species in history.species]) if(len(history)>0) else np.zeros(0)
+
+    variables, means, covs = {}, {}, {}
+
+    def variable(name):
+        if(name not in variables):
+            if(name in history.columns):
+                variables[name] = history[name]
+            elif(name=='p'):
+                variables[name] = np.sqrt(history['px']**2 + history['py']**2 + history['pz']**2)
+            elif(name=='energy'):
+                variables[name] = np.sqrt(variable('p')**2 + history.broadcast(mc)**2)
+            elif(name=='kinetic_energy'):
+                variables[name] = variable('energy') - history.broadcast(mc)
+            elif(name=='gamma'):
+                variables[name] = variable('energy')/history.broadcast(mc)
+            elif(name=='beta'):
+                variables[name] = variable('p')/variable('energy')
+            elif(name in ['beta_x', 'beta_y', 'beta_z']):
+                variables[name] = history['p'+name[-1]]/variable('energy')
+            elif(name=='r'):
+                variables[name] = np.hypot(history['x'], history['y'])
+            elif(name=='theta'):
+                variables[name] = np.arctan2(history['y'], history['x'])
+            elif(name=='pr'):
+                variables[name] = history['px']*np.cos(variable('theta')) + history['py']*np.sin(variable('theta'))
+            elif(name=='ptheta'):
+                variables[name] = -history['px']*np.sin(variable('theta')) + history['py']*np.cos(variable('theta'))
+            elif(name in ['xp', 'yp']):
+                variables[name] = history['p'+name[0]]/history['pz']
+        return variables[name]
+
+    def mean(name):
+        if(name not in means):
+            means[name] = history.sum(variable(name)*weight)/sum_weight
+        return means[name]
+
+    def delta(name):
+        return variable(name) - history.broadcast(mean(name))
+
+    def cov(a, b):
+        if((a, b) not in covs):
+            # np.cov with aweights divides by sum(w) - sum(w**2)/sum(w)
+            norm = sum_weight - history.sum(weight**2)/sum_weight
+            covs[(a, b)] = covs[(b, a)] = history.sum(delta(a)*delta(b)*weight)/norm
+        return covs[(a, b)]
+
+    def norm_emit(planes):
+        names = [name for plane in planes for name in [plane, 'p'+plane]]
+        matrix = np.stack([np.stack([cov(a, b) for b in names], axis=-1) for a in names], axis=-2)
+        return np.sqrt(np.linalg.det(matrix))/mc**len(planes)
+
+    stats = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        for key in keys:
+
+            operator, _, name = key.partition('_')
+
+            if(key=='n_particle'):
+                stats[key] = history.n_particle
+
+            elif(key=='n_alive'):
+                stats[key] = history.sum((history['status']==1).astype(int)).astype(int)
+
+            elif(key=='charge'):
+                stats[key] = sum_weight
+
+            elif(key in ['norm_emit_x', 'norm_emit_y']):
+                stats[key] = norm_emit([key[-1]])
+
+            elif(key=='norm_emit_4d'):
+                stats[key] = norm_emit(['x', 'y'])
+
+            elif(operator=='cov' and '__' in name and all(n in HISTORY_STAT_VARIABLES for n in name.split('__'))):
+                stats[key] = cov(*name.split('__'))
+
+            elif(operator in HISTORY_STAT_OPERATORS and name in HISTORY_STAT_VARIABLES):
+
+                if(operator=='mean'):
+                    stats[key] = mean(name)
+                elif(operator=='sigma'):
+                    stats[key] = np.sqrt(history.sum(delta(name)**2*weight)/sum_weight)
+                elif(operator=='min'):
+                    stats[key] = history.min(variable(name))
+                elif(operator=='max'):
+                    stats[key] = history.max(variable(name))
+                else:
+                    stats[key] = history.max(variable(name)) - history.min(variable(name))
+
+            else:
+                stats[key] = np.array([pg[key] for pg in history])
+
+    return stats
+
+
+def particle_cache_file(gdffile):
+    """ Name of the converted particle cache of gdffile """
+    return gdffile + '.particles.h5'
+
+
+def particle_cache_stamp(gdffile, columns=None):
+    """ 
+    The attributes a particle cache must have to match gdffile: the cache layout version, 
+    the size and modification time of the file and the columns it was read with.
+    """
+    stat = os.stat(gdffile)
+    return {'version':PARTICLE_CACHE_VERSION, 'size':stat.st_size, 'mtime':stat.st_mtime_ns, 'columns':json.dumps(columns)}
+
+
+def write_particle_cache(gdffile, touts, screens, columns=None):
+    """
+    Writes the tout and screen ParticleGroups read from gdffile to its particle cache (see particle_cache_file).
+
+    Each of PARTICLE_CACHE_KEYS is stored as one contiguous HDF5 dataset holding every group back to back, 
+    with the start of each group in 'offsets', so reading the cache back is a memory map per column.
+    Does nothing if the cache can't be written next to the file.
+    """
+
+    history = ParticleHistory.from_particle_groups(list(touts) + list(screens))
+
+    try:
+        with h5py.File(particle_cache_file(gdffile), 'w') as h5:
+            
+            for key, value in particle_cache_stamp(gdffile, columns).items():
+                h5.attrs[key] = value
+
+            h5.attrs['n_tout'] = len(touts)
+            h5.attrs['species'] = json.dumps(history.species)
+            h5['offsets'] = history.offsets
+
+            for key in PARTICLE_CACHE_KEYS:
+                h5[key] = history[key]
+
+    except OSError:
+        pass
+
+
+def read_particle_cache(gdffile, columns=None):
+    """
+    Returns the (touts, screens) ParticleGroups stored in the particle cache of gdffile by write_particle_cache,
+    or None if there is no cache or it was made from a different version of the file or with different columns.
+
+    The columns are memory mapped copy-on-write, so the groups are views into the cache file 
+    and only the pages that are used are read.
+    """
+
+    cache_file = particle_cache_file(gdffile)
+
+    if(not os.path.exists(cache_file)):
+        return None
+
+    try:
+        with h5py.File(cache_file, 'r') as h5:
+
+            stamp = particle_cache_stamp(gdffile, columns)
+            if(any(key not in h5.attrs or h5.attrs[key]!=value for key, value in stamp.items())):
+                return None
+
+            n_tout = int(h5.attrs['n_tout'])
+            species = json.loads(h5.attrs['species'])
+            offsets = h5['offsets'][:]
+
+            arrays = {}
+            for key in PARTICLE_CACHE_KEYS:
+                dataset = h5[key]
+                offset = dataset.id.get_offset()
+
+                if(offset is None):  # Empty, or not stored contiguously
+                    arrays[key] = dataset[()]
+                else:
+                    arrays[key] = np.memmap(cache_file, dtype=dataset.dtype, mode='c', offset=offset, shape=dataset.shape)
+
+    except (OSError, KeyError, ValueError):
+        return None
+
+    groups = list(ParticleHistory(arrays, offsets, species))
+
+    return (groups[:n_tout], groups[n_tout:])
+
+
+def iter_particle_groups(gdffile, data_type='tout', ref_ccs=False, use_mmap=False, columns=None):
+    """
+    Streams the ParticleGroups of a GPT output gdf file one at a time, in file order.
+    
+    data_type selects 'tout', 'screen' or 'all' groups. Only one group is held in memory, 
+    so this can be passed straight to particle_stats to reduce long runs with bounded memory:
+
+        particle_stats(iter_particle_groups('gpt.out.gdf'), ['mean_z', 'sigma_x'])
+    """
+    if(data_type not in ['tout', 'screen', 'all']):
+        raise ValueError(f'Unsupported GPT data type: {data_type}')
+
+    for kind, datum, _ in iter_gdf_file(gdffile, use_mmap=use_mmap, columns=columns):
+
+        if(data_type!='all' and kind!=data_type):
+            continue
+
+        particle_group = ParticleGroup(data=raw_data_to_particle_data(datum))
+
+        if(ref_ccs and kind=='tout'):
+            particle_group = transform_groups_to_centroid_coordinates([particle_group])[0]
+
+        yield particle_group
+
+
+def gdf_block_to_particle_group(block, ref_ccs=False, columns=None):
+    """
+    Converts a single easygdf.GDFBlock tout or screen record to a ParticleGroup. 
+    Returns None if the block has no particles.
+    """
+    if(block.kind=='tout'):
+        data, _ = make_tout_dict([block], columns=columns)
+    else:
+        data = make_screen_dict([block], columns=columns)
+
+    if(len(data)==0):
+        return None
+
+    particle_group = ParticleGroup(data=raw_data_to_particle_data(data[0]))
+
+    if(ref_ccs and block.kind=='tout'):
+        particle_group = transform_groups_to_centroid_coordinates([particle_group])[0]
+
+    return particle_group
+
+
 def initial_beam_to_particle_group(gdffile, verbose=0, extra_screen_keys=['q','nmacro','ID', 'm'], missing_data=None):
 
     screen  = read_particle_gdf_file(gdffile, verbose=verbose, extra_screen_keys=extra_screen_keys)
@@ -146,6 +989,48 @@ def initial_beam_to_particle_group(gdffile, verbose=0, extra_screen_keys=['q','n
     return ParticleGroup(data=raw_data_to_particle_data(screen))
 
 
+def write_particle_group_gdf(particle_group, gdffile, verbose=False):
+    """
+    Writes a ParticleGroup to gdffile as a GPT initial distribution, with the 
+    columns 'x', 'y', 'z', 'GBx', 'GBy', 'GBz', 't', 'q', 'm', 'nmacro', 'ID' in SI units.
+    
+    Same file as pmd_beamphysics.interfaces.gpt.write_gpt followed by asci2gdf, 
+    but the binary GDF is written directly from the particle arrays.
+    
+    """
+
+    assert np.all(particle_group.weight >= 0), "ParticleGroup.weight must be >= 0"
+
+    q = particle_group.species_charge
+    mc2 = particle_group.mass   # [eV]
+    m = mc2 * (e_charge / c_light**2)
+    n = particle_group.n_particle
+
+    data = {
+        "x": particle_group.x,
+        "y": particle_group.y,
+        "z": particle_group.z,
+        "GBx": particle_group.px / mc2,
+        "GBy": particle_group.py / mc2,
+        "GBz": particle_group.pz / mc2,
+        "t": particle_group.t,
+        "q": np.full(n, q),
+        "m": np.full(n, m),
+        "nmacro": np.abs(particle_group.weight / q),
+    }
+
+    if hasattr(particle_group, "id"):
+        data["ID"] = particle_group.id
+    else:
+        data["ID"] = np.arange(1, n + 1)
+
+    if(verbose):
+        print(f"writing {n} particles to {gdffile}")
+
+    with open(gdffile, 'wb') as f:
+        easygdf.save_dict(f, data)
+
+
 def particle_stats(particle_groups, key):
     """
     Gets statistic of a list of particle groups
@@ -159,10 +1044,32 @@ def particle_stats(particle_groups, key):
         norm_emit_x
         mean_kinetic_energy
         ...
-        
+
+    key can also be a list of keys, in which case a dict of arrays is returned. 
+    The groups are then visited only once, so particle_groups can be a generator 
+    such as iter_particle_groups.
+
+    A ParticleHistory, or a list of groups which is copied into one, is reduced 
+    for all groups at once by particle_history_stats.
     
     """
-    return np.array([p[key] for p in particle_groups])
+    if(isinstance(particle_groups, (list, tuple))):
+        particle_groups = ParticleHistory.from_particle_groups(particle_groups)
+
+    if(isinstance(particle_groups, ParticleHistory)):
+        if(isinstance(key, str)):
+            return particle_history_stats(particle_groups, [key])[key]
+        return particle_history_stats(particle_groups, key)
+
+    if(isinstance(key, str)):
+        return np.array([p[key] for p in particle_groups])
+
+    stats = {k:[] for k in key}
+    for p in particle_groups:
+        for k in key:
+            stats[k].append(p[k])
+
+    return {k:np.array(v) for k, v in stats.items()}
 
     
     
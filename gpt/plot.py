@@ -66,7 +66,10 @@ def plot_stats_with_layout(gpt_object, ykeys=['sigma_x', 'sigma_y'], ykeys2=['me
     
     #assert xkey == 'mean_z', 'TODO: other x keys'
         
-    X = I.stat(xkey, data_type=data_type)
+    # All of the plotted stats in one pass over the particles
+    stats = I.stat(list(dict.fromkeys([xkey] + list(ykeys) + list(ykeys2 or []))), data_type=data_type)
+
+    X = stats[xkey]
     
     # Only get the data we need
     if xlim:
@@ -111,7 +114,7 @@ def plot_stats_with_layout(gpt_object, ykeys=['sigma_x', 'sigma_y'], ykeys2=['me
         units = str(ulist[0])
         
         # Data
-        data = [I.stat(key, data_type=data_type)[good] for key in keys]        
+        data = [stats[key][good] for key in keys]        
         
         if nice:
             factor, prefix = nice_scale_prefix(np.ptp(data))
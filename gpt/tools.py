@@ -4,6 +4,7 @@ import numpy as np
 import json
 
 import subprocess
+import asyncio
 import os
 import datetime
 import time
@@ -22,15 +23,118 @@ from scipy.constants import c
 
 DEFAULT_KILL_MSGS = ["gpt: Spacecharge3Dmesh:", 'Error:', 'gpt: No valid GPT license', 'malloc', 'Segmentation fault']
 
-def execute(cmd, kill_msgs=[], verbose=False, timeout=1e6, workdir=''):
+def execute(cmd, kill_msgs=[], verbose=False, timeout=1e6, workdir='', monitor=None, monitor_interval=1.0):
 
-    """ Function for execution of GPT """
-    w = Watcher(cmd=cmd, timeout=timeout, verbose=verbose, kill_msgs=kill_msgs, workdir=workdir)
+    """ 
+    Function for execution of GPT 
+
+    monitor(done) is called every monitor_interval seconds while GPT runs, see Watcher.
+    """
+    w = Watcher(cmd=cmd, timeout=timeout, verbose=verbose, kill_msgs=kill_msgs, workdir=workdir, monitor=monitor, monitor_interval=monitor_interval)
     w.run()
 
     return w.run_time, w.exception, w.log
 
 
+def run_in_thread(func, *args):
+    """ 
+    Runs func(*args) in the event loop's default thread pool and returns an awaitable of the result, 
+    so blocking work (file I/O, parsing output) does not hold up the other coroutines on the loop.
+    """
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def execute_async(cmd, kill_msgs=[], verbose=False, timeout=1e6, workdir='', monitor=None, monitor_interval=1.0):
+
+    """ 
+    Coroutine version of execute, for running many GPT jobs from one event loop. 
+
+    GPT runs as an asyncio subprocess and its log (stderr) is read line by line as it is written. 
+    GPT is killed when a line contains one of kill_msgs (that line is the exception), 
+    or when it runs longer than timeout [sec] (the exception says so). 
+    monitor(done) is called in a worker thread (see run_in_thread) every monitor_interval seconds while GPT runs, 
+    and once more with done=True after it exits. The calls never overlap. If it raises, it is not called again and the run's exception says so.
+
+    Returns run_time, exception, log as execute does.
+    """
+
+    if(isinstance(cmd, str)):
+        cmd = cmd.split(' ')
+
+    t1 = time.time()
+
+    process = await asyncio.create_subprocess_exec(*cmd, 
+                                                   stdout=asyncio.subprocess.DEVNULL, 
+                                                   stderr=asyncio.subprocess.PIPE, 
+                                                   cwd=workdir or None)
+    log = []
+    exception = None
+    monitor_exception = None
+
+    def kill():
+        try:
+            process.kill()
+        except ProcessLookupError:  # Already exited
+            pass
+
+    async def read_log():
+        nonlocal exception
+        async for raw_line in process.stderr:
+            line = raw_line.decode(errors='replace')
+            log.append(line)
+            if(verbose):
+                print(line.strip('\n'))
+
+            for msg in kill_msgs:
+                if msg in line:
+                    kill()
+                    exception = line
+                    break
+
+    stop = asyncio.Event()
+
+    async def watch():
+        nonlocal monitor_exception
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), monitor_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await run_in_thread(monitor, False)
+            except Exception as ex:
+                monitor_exception = ex
+                return
+
+    watcher = asyncio.ensure_future(watch()) if(monitor is not None) else None
+
+    try:
+        await asyncio.wait_for(read_log(), timeout)
+    except asyncio.TimeoutError:
+        kill()
+        exception = f'GPT killed after timeout = {timeout} sec.'
+    finally:
+        # Let a monitor call in progress finish rather than cancelling it, so it can't overlap the last one
+        if(watcher is not None):
+            stop.set()
+            await watcher
+
+    await process.wait()
+
+    if(monitor is not None and monitor_exception is None):
+        try:
+            await run_in_thread(monitor, True)
+        except Exception as ex:
+            monitor_exception = ex
+
+    if(monitor_exception is not None and exception is None):
+        exception = f'Output monitor failed: {monitor_exception!r}'
+
+    return time.time() - t1, exception, log
+
+
 def executeOld(cmd):
     """
     
@@ -6,13 +6,16 @@ class Watcher():
     """
     Watcher class for line by line watching of subprocess with a timeout
     """
-    def __init__(self, cmd, verbose=False, timeout=10, kill_msgs=[], workdir=''):
+    def __init__(self, cmd, verbose=False, timeout=10, kill_msgs=[], workdir='', monitor=None, monitor_interval=1.0):
 
         """
         cmd: str, command to run via subprocess 
         timeout: float [sec], watcher kills subprocess when t > timeout
         kill_msgs: list(str), list of strings to check from in output lines from subprocess.  
                    If found in output line, subprocess is killed.
+        monitor: callable(done), called every monitor_interval [sec] with done=False while the subprocess runs, 
+                 and once more with done=True after it exits. If it raises, it is not called again: 
+                 the error is kept in monitor_exception and reported as the exception of the run.
         """
 
         if(isinstance(cmd, str)):
@@ -31,6 +34,10 @@ class Watcher():
         self.log = []
         self.run_time = None
         self.workdir = workdir
+        self.monitor = monitor
+        self.monitor_interval = monitor_interval
+        self.monitor_thread = None
+        self.monitor_exception = None
 
     def runner(self):
 
@@ -42,6 +49,17 @@ class Watcher():
             self.timeout_occured=True
             self.cmd_popen.kill()
 
+    def monitor_runner(self):
+
+        """ Calls the monitor every monitor_interval until the subprocess is done """
+
+        while not self.t_event.wait(self.monitor_interval):
+            try:
+                self.monitor(False)
+            except Exception as ex:
+                self.monitor_exception = ex
+                break
+
     def execute(self):
 
         """ Runs the subprocess command and starts the monitor thread Yields output lines from subprocess."""
@@ -54,6 +72,10 @@ class Watcher():
                                           cwd=self.workdir)
         self.thread.start()
 
+        if(self.monitor is not None):
+            self.monitor_thread = threading.Thread(target=self.monitor_runner)
+            self.monitor_thread.start()
+
         for stdout_line in iter(self.cmd_popen.stderr.readline, ""):
             yield stdout_line
 
@@ -73,6 +95,19 @@ class Watcher():
                     break
 
         self.t_event.set()
+
+        if(self.monitor_thread is not None):
+            self.monitor_thread.join()
+            self.cmd_popen.wait()
+            if(self.monitor_exception is None):
+                try:
+                    self.monitor(True)
+                except Exception as ex:
+                    self.monitor_exception = ex
+
+            if(self.monitor_exception is not None and self.exception is None):
+                self.exception = f'Output monitor failed: {self.monitor_exception!r}'
+
         t2 = time.time()
         self.run_time=t2-t1
 
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from gpt import easygdf
+
+
+M_E = 9.1093837015e-31
+Q_E = -1.602176634e-19
+
+
+def write_array(f, name, array):
+    array = np.ascontiguousarray(array, dtype='f8')
+    easygdf._write_block_header(f, name, easygdf.GDF_ARRAY | easygdf.GDF_DOUBLE, array.nbytes)
+    f.write(array.tobytes())
+
+
+def write_gpt_gdf(path, n_tout=6, n_screen=3, n_particle=50, n_lost=4, seed=0, fields=False):
+    """
+    Writes a small synthetic GPT output file: touts then screens, laid out as GPT writes them.
+    n_lost particles are dropped after every tout and screen, and each tout stores its particles in a shuffled order.
+    With fields the touts also hold the field arrays fEx, ..., fBz.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_particle+1)
+
+    with open(path, 'wb') as f:
+        easygdf._write_header(f, 'ASCI2GDF', 'GPT')
+
+        for ii in range(n_tout):
+            m = len(ids)
+            easygdf._write_single(f, 'time', ii*1e-10, easygdf.GDF_DIRECTORY)
+            bz = 0.9 + rng.normal(size=m)*1e-3
+            arrays = {'ID':rng.permutation(ids),
+                      'x':rng.normal(size=m)*1e-3 + ii*1e-4, 'y':rng.normal(size=m)*1e-3, 'z':rng.normal(size=m)*1e-3 + ii*0.03,
+                      'Bx':rng.normal(size=m)*1e-3 + ii*1e-4, 'By':rng.normal(size=m)*1e-3, 'Bz':bz,
+                      'rxy':rng.random(m), 'm':np.full(m, M_E), 'q':np.full(m, Q_E), 'nmacro':rng.uniform(50, 150, m),
+                      'rmacro':np.zeros(m)}
+            arrays['G'] = 1/np.sqrt(1 - arrays['Bx']**2 - arrays['By']**2 - arrays['Bz']**2)
+            if(fields):
+                for name in ['fEx', 'fEy', 'fEz', 'fBx', 'fBy', 'fBz']:
+                    arrays[name] = rng.normal(size=m)
+            for name, array in arrays.items():
+                write_array(f, name, array)
+            easygdf._write_block_header(f, '', easygdf.GDF_END, 0)
+
+            ids = np.sort(rng.permutation(ids)[n_lost:])
+
+        for ii in range(n_screen):
+            m = len(ids)
+            position = 0.1*(n_screen-ii)
+            easygdf._write_single(f, 'position', position, easygdf.GDF_DIRECTORY)
+            arrays = {'ID':ids, 'x':rng.normal(size=m)*1e-3, 'y':rng.normal(size=m)*1e-3, 'z':np.full(m, position),
+                      'Bx':rng.normal(size=m)*1e-3, 'By':rng.normal(size=m)*1e-3, 'Bz':0.9 + rng.normal(size=m)*1e-3,
+                      't':rng.normal(size=m)*1e-12 + 1e-9*position, 'm':np.full(m, M_E), 'q':np.full(m, Q_E),
+                      'nmacro':np.full(m, 100.0), 'rmacro':np.zeros(m)}
+            arrays['G'] = 1/np.sqrt(1 - arrays['Bx']**2 - arrays['By']**2 - arrays['Bz']**2)
+            for name, array in arrays.items():
+                write_array(f, name, array)
+            easygdf._write_block_header(f, '', easygdf.GDF_END, 0)
+
+            ids = np.sort(rng.permutation(ids)[n_lost:])
+
+
+@pytest.fixture
+def gpt_gdf(tmp_path):
+    path = tmp_path/'gpt.out.gdf'
+    write_gpt_gdf(path)
+    return str(path)
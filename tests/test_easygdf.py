@@ -0,0 +1,193 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from gpt import easygdf
+
+from conftest import write_gpt_gdf
+
+
+TYPED_ARRAYS = {
+    'x':   (easygdf.GDF_FLOAT,  np.array([1.5, -2.25, 3.0], dtype='f4')),
+    'ID':  (easygdf.GDF_UINT32, np.array([1, 7, 4000000000], dtype='u4')),
+    'Bz':  (easygdf.GDF_DOUBLE, np.array([0.1, 0.2, 0.3], dtype='f8')),
+    'n16': (easygdf.GDF_INT16,  np.array([-3, 0, 300], dtype='i2')),
+    'n8':  (easygdf.GDF_INT8,   np.array([-1, 2, 127], dtype='i1')),
+    'u8':  (easygdf.GDF_UINT8,  np.array([0, 1, 255], dtype='u1')),
+    'u16': (easygdf.GDF_UINT16, np.array([0, 1, 65535], dtype='u2')),
+    'n32': (easygdf.GDF_INT32,  np.array([-5, 6, 2**31-1], dtype='i4')),
+    'n64': (easygdf.GDF_INT64,  np.array([-5, 6, 2**40], dtype='i8')),
+    'u64': (easygdf.GDF_UINT64, np.array([0, 6, 2**50], dtype='u8')),
+}
+
+
+def write_typed_gdf(path, arrays, tout=True):
+    """ Writes arrays with their real GDF type flags, as a tout or at the root of the file """
+    with open(path, 'wb') as f:
+        easygdf._write_header(f, 'test', '')
+        if(tout):
+            easygdf._write_single(f, 'time', 1e-9, easygdf.GDF_DIRECTORY)
+        for name, (flag, array) in arrays.items():
+            easygdf._write_block_header(f, name, easygdf.GDF_ARRAY | flag, array.nbytes)
+            f.write(array.tobytes())
+        if(tout):
+            easygdf._write_block_header(f, '', easygdf.GDF_END, 0)
+
+
+def test_type_flags_are_hex():
+    assert easygdf.GDF_FLOAT == 0x90
+    assert easygdf.GDF_INT16 == 0x50
+    assert easygdf.GDF_INT32 == 0x02
+    assert easygdf.GDF_INT64 == 0x80
+    assert easygdf.GDF_UINT8 == 0x20
+    assert easygdf.GDF_UINT16 == 0x40
+    assert easygdf.GDF_UINT32 == 0x60
+    assert easygdf.GDF_UINT64 == 0x70
+    assert easygdf.GDF_INT8 == 0x30
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_typed_tout_round_trip(tmp_path, use_mmap):
+    path = tmp_path/'typed.gdf'
+    write_typed_gdf(path, TYPED_ARRAYS)
+
+    with open(path, 'rb') as f:
+        touts, screens = easygdf.load_dict(f, use_mmap=use_mmap)
+
+    assert len(touts)==1 and len(screens)==0
+    for name, (_, array) in TYPED_ARRAYS.items():
+        assert touts[0][name].dtype == np.dtype('d')
+        assert np.array_equal(touts[0][name], array.astype('d')), name
+
+
+def test_typed_tout_compact(tmp_path):
+    path = tmp_path/'typed.gdf'
+    write_typed_gdf(path, TYPED_ARRAYS)
+
+    with open(path, 'rb') as f:
+        blocks = list(easygdf.iter_blocks(f, compact=True))
+
+    assert len(blocks)==1 and blocks[0].kind=='tout'
+    for name, (_, array) in TYPED_ARRAYS.items():
+        assert blocks[0].arrays[name].dtype == array.dtype, name
+        assert np.array_equal(blocks[0].arrays[name], array), name
+
+
+def test_typed_root_arrays_round_trip(tmp_path):
+    path = tmp_path/'typed_root.gdf'
+    write_typed_gdf(path, TYPED_ARRAYS, tout=False)
+
+    with open(path, 'rb') as f:
+        arrays = easygdf.load_arrays(f, compact=True)
+
+    assert list(arrays) == list(TYPED_ARRAYS)
+    for name, (_, array) in TYPED_ARRAYS.items():
+        assert arrays[name].dtype == array.dtype
+        assert np.array_equal(arrays[name], array), name
+
+
+def test_save_dict_round_trip(tmp_path):
+    path = tmp_path/'saved.gdf'
+    data = {'x':np.linspace(0, 1, 5), 'ID':np.arange(1, 6)}
+
+    with open(path, 'wb') as f:
+        easygdf.save_dict(f, data)
+
+    with open(path, 'rb') as f:
+        arrays = easygdf.load_arrays(f)
+
+    for name, array in data.items():
+        assert np.array_equal(arrays[name], array)
+
+
+class CountingBytesIO(io.BytesIO):
+    """ In memory file that can't be memory mapped, counting the bytes read from it """
+
+    mode = 'rb'
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_build_index_without_mmap(gpt_gdf):
+    with open(gpt_gdf, 'rb') as f:
+        index = easygdf.build_index(f)
+        f.seek(0)
+        stream = CountingBytesIO(f.read())
+
+    assert easygdf.build_index(stream) == index
+    assert stream.bytes_read < len(stream.getvalue())//4
+
+
+def test_short_read_raises(tmp_path):
+    path = tmp_path/'typed.gdf'
+    write_typed_gdf(path, TYPED_ARRAYS)
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 24 - 8)  # Into the data of the last array
+
+    with open(path, 'rb') as f:
+        with pytest.raises(ValueError):
+            easygdf.load_dict(f)
+
+
+@pytest.mark.parametrize('mappable', [True, False])
+def test_load_array_names(tmp_path, mappable):
+    path = tmp_path/'typed.gdf'
+    write_typed_gdf(path, TYPED_ARRAYS, tout=False)
+
+    with open(path, 'rb') as f:
+        expected = list(easygdf.load_arrays(f))
+        f.seek(0)
+        stream = f if(mappable) else CountingBytesIO(f.read())
+
+        assert easygdf.load_array_names(stream) == expected == list(TYPED_ARRAYS)
+
+    if(not mappable):
+        assert stream.bytes_read < 48 + 32*len(TYPED_ARRAYS)
+
+
+def test_load_array_names_skips_touts(gpt_gdf):
+    with open(gpt_gdf, 'rb') as f:
+        assert easygdf.load_array_names(f) == list(easygdf.load_arrays(f)) == []
+
+
+def test_load_index_sidecar(gpt_gdf, monkeypatch):
+    index = easygdf.load_index(gpt_gdf)
+    assert os.path.exists(gpt_gdf + '.index')
+
+    with monkeypatch.context() as m:
+        m.setattr(easygdf, 'build_index', None)  # The file must not be scanned again
+        assert easygdf.load_index(gpt_gdf) == index
+
+    # Rewritten with other particles, the stale sidecar is replaced
+    write_gpt_gdf(gpt_gdf, n_particle=40, seed=1)
+    with open(gpt_gdf, 'rb') as f:
+        rebuilt = easygdf.build_index(f)
+    assert rebuilt != index
+
+    assert easygdf.load_index(gpt_gdf) == rebuilt
+    with open(gpt_gdf + '.index') as f:
+        assert json.load(f)['blocks'] == rebuilt
+
+    # Touched but the same size
+    stat = os.stat(gpt_gdf)
+    os.utime(gpt_gdf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with monkeypatch.context() as m:
+        calls = []
+        m.setattr(easygdf, 'build_index', lambda f: calls.append(f) or rebuilt)
+        assert easygdf.load_index(gpt_gdf) == rebuilt
+        assert len(calls) == 1
+
+    # Made by another version of the index layout
+    with monkeypatch.context() as m:
+        m.setattr(easygdf, 'GDF_INDEX_VERSION', easygdf.GDF_INDEX_VERSION+1)
+        calls = []
+        m.setattr(easygdf, 'build_index', lambda f: calls.append(f) or rebuilt)
+        assert easygdf.load_index(gpt_gdf) == rebuilt
+        assert len(calls) == 1
@@ -0,0 +1,230 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+from conftest import write_gpt_gdf
+from gpt import GPT
+from gpt import easygdf
+from gpt import parsers
+from gpt import tools
+from gpt.gpt import run_gpt_many
+
+
+def load(gdffile, **kwargs):
+    G = GPT(**kwargs)
+    G.input_file = gdffile
+    G.load_output(gdffile)
+    return G
+
+
+@pytest.mark.parametrize('lazy_output', [False, True])
+def test_tout_only_columns(gpt_gdf, lazy_output):
+    G = load(gpt_gdf, columns=['ID', 'rxy'], lazy_output=lazy_output)
+
+    assert 'rxy' not in parsers.gdf_columns(['ID', 'rxy'], kind='screen')
+    assert np.all(np.isfinite(G.stat('sigma_x', 'screen')))
+    assert np.all(np.isfinite(G.stat('sigma_x', 'tout')))
+
+
+@pytest.mark.parametrize('columns', [None, [], ['rxy']])
+def test_ids_always_read(gpt_gdf, columns):
+    G = load(gpt_gdf, columns=columns)
+    touts, _, _ = parsers.read_gdf_file(gpt_gdf)
+
+    for pg, datum in zip(G.tout, touts):
+        assert np.array_equal(pg.id, datum['ID'])
+    assert not np.array_equal(G.tout[-1].id, np.arange(1, G.tout[-1].n_particle+1))
+
+
+def test_failed_run_without_output(tmp_path):
+    G = GPT()
+    G.input_file = str(tmp_path/'gpt.in')
+
+    G._finish_run({'start_time':0}, 'timeout', [])
+
+    assert G.error and G.output['error'] and G.finished
+    assert G.n_tout == 0 and G.n_screen == 0 and len(G.output['particles']) == 0
+
+
+@pytest.mark.parametrize('n_complete, cut', [(0, 10), (3, 24), (3, 300), (6, 8)])
+def test_failed_run_keeps_complete_touts(gpt_gdf, tmp_path, n_complete, cut):
+    reference = load(gpt_gdf)
+    with open(gpt_gdf, 'rb') as f:
+        index = easygdf.build_index(f)
+
+    # Cut the file off inside the tout or screen after the complete ones
+    with open(gpt_gdf, 'r+b') as f:
+        f.truncate(index[n_complete]['offset'] + cut)
+
+    G = GPT()
+    G.input_file = str(tmp_path/'gpt.in')
+    G._finish_run({'start_time':0}, 'timeout', [])
+
+    assert G.error and G.finished
+    assert G.n_tout == n_complete and G.n_screen == 0 and len(G.fields) == n_complete
+    for pg, ref in zip(G.tout, reference.tout):
+        assert np.array_equal(pg.x, ref.x) and np.array_equal(pg.id, ref.id)
+
+
+def test_tout_ccs(gpt_gdf):
+    G = load(gpt_gdf)
+
+    for pg, ccs in zip(G.tout, G.tout_ccs):
+        ref = tools.transform_to_centroid_coordinates(pg)
+        for key in ['x', 'y', 'z', 'px', 'py', 'pz', 't', 'weight', 'id']:
+            assert np.allclose(ccs[key], ref[key], rtol=1e-12, atol=1e-15), key
+
+
+def test_tout_ccs_read_only(gpt_gdf):
+    G = load(gpt_gdf)
+    sigma_x = G.tout_ccs_stat('sigma_x')
+
+    pg = G.tout_ccs[1]
+    with pytest.raises(ValueError):
+        pg.x += 1
+
+    pg = pg.copy()
+    pg.x *= 2
+    assert np.array_equal(G.tout_ccs_stat('sigma_x'), sigma_x)
+    assert np.allclose([pg['sigma_x'] for pg in G.tout_ccs], sigma_x, rtol=1e-12)
+
+
+@pytest.mark.parametrize('lazy_output', [False, True])
+@pytest.mark.parametrize('data_type', ['tout', 'screen'])
+def test_trajectories(gpt_gdf, tmp_path, lazy_output, data_type):
+    G = load(gpt_gdf, lazy_output=lazy_output)
+    groups = getattr(G, data_type)
+
+    trajectories = G.trajectories(data_type=data_type, memmap_dir=str(tmp_path) if(lazy_output) else None)
+
+    assert np.array_equal(trajectories['id'], np.unique(np.concatenate([pg.id for pg in groups])))
+    assert not trajectories['mask'].all()  # Particles are lost along the way
+
+    for row, pid in enumerate(trajectories['id']):
+        assert np.array_equal(trajectories['mask'][row], [pid in pg.id for pg in groups])
+
+        trajectory = G.trajectory(pid, data_type=data_type)
+        for var, values in trajectory.items():
+            assert np.array_equal(trajectories[var][row][trajectories['mask'][row]], values), var
+
+
+@pytest.mark.parametrize('ref_ccs', [False, True])
+@pytest.mark.parametrize('options', [{'cache_output':True}, {}])
+def test_timeline_eager_matches_lazy(gpt_gdf, ref_ccs, options):
+    lazy = load(gpt_gdf, lazy_output=True, ref_ccs=ref_ccs).timeline
+    eager = load(gpt_gdf, ref_ccs=ref_ccs, **options).timeline
+
+    assert list(eager.kind) == list(lazy.kind)
+    for key in ['time', 'mean_z', 's', 'n']:
+        assert np.allclose(getattr(eager, key), getattr(lazy, key), rtol=1e-9, atol=1e-15), key
+    assert np.all(np.diff(eager.mean_z[eager.kind=='tout']) > 0)
+
+    for z in [0.02, 0.05, 0.09]:
+        assert list(eager.between(0, z, key='mean_z', kind='tout')) == list(lazy.between(0, z, key='mean_z', kind='tout'))
+        assert eager.at_z(z, 'tout') == lazy.at_z(z, 'tout')
+
+
+def test_tout_ccs_lazy(gpt_gdf):
+    eager = load(gpt_gdf)
+    lazy = load(gpt_gdf, lazy_output=True)
+
+    assert isinstance(eager.tout_ccs, list)
+    assert len(lazy.tout_ccs) == lazy.n_tout
+    assert len(lazy.output['particles']._cache) == 0  # Nothing is decoded up front
+
+    for pg, ref in zip(lazy.tout_ccs, eager.tout_ccs):
+        for key in ['x', 'y', 'z', 'px', 'py', 'pz', 'id']:
+            assert np.allclose(pg[key], ref[key], rtol=1e-9, atol=1e-15), key
+
+    assert np.allclose(lazy.tout_ccs_stat('sigma_x'), eager.tout_ccs_stat('sigma_x'), rtol=1e-9)
+    assert np.allclose(lazy.trajectories('tout_ccs')['x'], eager.trajectories('tout_ccs')['x'], rtol=1e-9, atol=1e-15, equal_nan=True)
+
+
+@pytest.mark.parametrize('lazy_output', [False, True])
+def test_tout_stat_vs_s(gpt_gdf, lazy_output):
+    G = load(gpt_gdf, lazy_output=lazy_output)
+    ref = load(gpt_gdf).tout
+
+    # Path length from the stats of each tout on its own
+    keys = ['mean_x', 'mean_y', 'mean_z', 'mean_t', 'mean_p', 'mean_beta']
+    stats = {key:np.array([pg[key] for pg in ref]) for key in keys}
+    drifting = np.abs(stats['mean_p'][0] - stats['mean_p'][1:])/stats['mean_p'][0] < 1e-5
+    ds = np.where(drifting, np.diff(stats['mean_t'])*stats['mean_beta'][:-1]*299792458, 
+                  np.sqrt(np.diff(stats['mean_x'])**2 + np.diff(stats['mean_y'])**2 + np.diff(stats['mean_z'])**2))
+    s_ccs = np.cumsum(np.concatenate([[np.sqrt(stats['mean_x'][0]**2 + stats['mean_y'][0]**2 + stats['mean_z'][0]**2)], ds]))
+
+    assert np.allclose(G.s_ccs, s_ccs, rtol=1e-12)
+
+    sigma_x = np.array([pg['sigma_x'] for pg in ref])
+    s, values = G.tout_stat_vs_s('sigma_x', s=s_ccs)
+    assert np.allclose(values, sigma_x, rtol=1e-12)
+
+    # Halfway between touts the stats are the mean of their neighbours
+    s_mid = (s_ccs[1:] + s_ccs[:-1])/2
+    s, values = G.tout_stat_vs_s(['sigma_x', 'norm_emit_x'], s=s_mid)
+    assert np.allclose(values['sigma_x'], (sigma_x[1:] + sigma_x[:-1])/2, rtol=1e-12)
+    emit = np.array([pg['norm_emit_x'] for pg in ref])
+    assert np.allclose(values['norm_emit_x'], (emit[1:] + emit[:-1])/2, rtol=1e-12)
+
+    s, values = G.tout_stat_vs_s('mean_z', n_points=11)
+    assert len(s) == 11 and s[0] == s_ccs[0] and np.isclose(s[-1], s_ccs[-1], rtol=1e-12)
+    assert np.isclose(values[0], stats['mean_z'][0]) and np.isclose(values[-1], stats['mean_z'][-1])
+
+
+FAKE_GPT = """#!{python}
+# Stands in for GPT: logs when it ran and with how many cores, then writes the output for its job
+import shutil, sys, time
+args = sys.argv[1:]
+variables = dict(line.strip().rstrip(';').split('=') for line in open(args[-1]) if '=' in line)
+job, fail = int(float(variables['job'])), int(float(variables['fail']))
+start = time.time()
+time.sleep(0.4)
+with open({log!r}, 'a') as f:
+    f.write(f'{{job}} {{args[0][2:]}} {{start}} {{time.time()}}\\n')
+if(fail==1):
+    sys.stderr.write('Error: bad input\\n')
+elif(fail==0):
+    shutil.copy({template!r}.format(job), args[args.index('-o')+1])
+"""
+
+
+def test_run_gpt_many(tmp_path):
+    log = tmp_path/'jobs.log'
+    gpt_bin = tmp_path/'gpt'
+    gpt_bin.write_text(FAKE_GPT.format(python=sys.executable, log=str(log), template=str(tmp_path/'job_{}.gdf')))
+    gpt_bin.chmod(0o755)
+    (tmp_path/'gpt.in').write_text('job=0;\nfail=0;\n')
+
+    n_cpu = [2, 1, 3, 1, 8, 2, 1, 2]
+    fail = [0, 1, 0, 2, 0, 0, 0, 0]  # Job 1 is killed for its log, job 3 writes no output
+    for job in range(len(n_cpu)):
+        write_gpt_gdf(tmp_path/f'job_{job}.gdf', n_tout=job+2, n_screen=1, n_particle=20, n_lost=0, seed=job)
+
+    settings_list = [{'job':job, 'fail':fail[job]} for job in range(len(n_cpu))]
+    results = run_gpt_many(settings_list, n_cpu=n_cpu, max_cores=4, gpt_bin=str(gpt_bin), gpt_input_file=str(tmp_path/'gpt.in'))
+
+    # Results come back in the order of the settings, the failed jobs without stopping the others
+    for job, G in enumerate(results):
+        if(fail[job]==2):
+            assert G['error'] and 'Traceback' in G['why_error']
+        elif(fail[job]==1):
+            assert G.error and 'Error: bad input' in G.output['why_error']
+        else:
+            assert not G.error and G.n_tout == job+2 and G.n_screen == 1
+
+    runs = {}
+    for line in log.read_text().split('\n')[:-1]:
+        job, cores, start, end = line.split()
+        runs[int(job)] = (int(cores), float(start), float(end))
+
+    assert sorted(runs) == list(range(len(n_cpu)))
+    assert [runs[job][0] for job in range(len(n_cpu))] == [min(n, 4) for n in n_cpu]
+
+    # The jobs running at any moment fit in max_cores, and no job starts well before an earlier one
+    for job, (cores, start, end) in runs.items():
+        assert sum(c for c, s, e in runs.values() if s <= start < e) <= 4
+        assert all(runs[earlier][1] < start + 0.2 for earlier in range(job))
+
+    # The 8 core job ran on its own
+    assert all(e <= runs[4][1] or s >= runs[4][2] for job, (c, s, e) in runs.items() if job != 4)
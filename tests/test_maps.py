@@ -0,0 +1,13 @@
+import numpy as np
+
+from gpt import easygdf
+from gpt.maps import get_gdf_header
+
+
+def test_get_gdf_header(tmp_path):
+    path = str(tmp_path/'field_map.gdf')
+    z = np.linspace(0, 1, 11)
+    with open(path, 'wb') as f:
+        easygdf.save_dict(f, {'z':z, 'Ez':np.sin(z)})
+
+    assert get_gdf_header(path) == ['z', 'Ez']
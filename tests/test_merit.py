@@ -0,0 +1,37 @@
+import numpy as np
+
+from gpt import GPT
+from gpt.merit import default_gpt_merit
+
+
+def load(gdffile, **kwargs):
+    G = GPT(**kwargs)
+    G.input_file = gdffile
+    G.load_output(gdffile)
+    G.initial_particles = {'n_particle':50}
+    return G
+
+
+def test_default_gpt_merit_final_screen(gpt_gdf):
+    G = load(gpt_gdf, lazy_output=True)
+
+    m = default_gpt_merit(G)
+
+    final = G.screen[-1]
+    assert not m['error']
+    assert len(G.output['particles']._cache) == 1  # Only the final screen is decoded
+    assert np.isclose(m['end_norm_emit_x'], final['norm_emit_x'], rtol=1e-9)
+    assert np.isclose(m['end_mean_kinetic_energy'], final['mean_kinetic_energy'], rtol=1e-9)
+    assert m['end_n_particle_loss'] == 50 - final['n_particle']
+    assert m['end_z_screen'] == final['mean_z']
+
+
+def test_default_gpt_merit_ignores_earlier_screens(gpt_gdf):
+    G = load(gpt_gdf)
+
+    # A screen with a single particle has no higher_order_energy_spread
+    n_tout = G.n_tout
+    G.output['particles'][n_tout] = G.output['particles'][n_tout][0:1]
+    G.clear_output_cache()
+
+    assert not default_gpt_merit(G)['error']
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from gpt import easygdf
+from gpt import parsers
+
+from conftest import write_gpt_gdf
+
+
+def assert_same_dicts(dicts, reference):
+    assert len(dicts) == len(reference)
+    for datum, ref in zip(dicts, reference):
+        if(ref is None):
+            assert datum is None
+            continue
+        assert sorted(datum) == sorted(ref)
+        for key in ref:
+            assert np.array_equal(datum[key], ref[key]), key
+
+
+@pytest.mark.parametrize('load_fields', [False, True])
+@pytest.mark.parametrize('columns', [None, ['rxy']])
+def test_threaded_read_matches_serial(tmp_path, load_fields, columns):
+    path = str(tmp_path/'gpt.out.gdf')
+    write_gpt_gdf(path, n_tout=12, n_screen=5, fields=True)
+
+    serial = parsers.read_gdf_file(path, load_fields=load_fields, columns=columns)
+    threaded = parsers.read_gdf_file(path, load_fields=load_fields, columns=columns, max_workers=4)
+
+    for data, reference in zip(threaded, serial):
+        assert_same_dicts(data, reference)
+
+    assert [tout['number'] for tout in threaded[0]] == list(range(12))
+    assert np.all(np.diff([screen['time'] for screen in threaded[1]]) > 0)
+
+
+def test_map_blocks_keeps_order(gpt_gdf):
+    with open(gpt_gdf, 'rb') as f:
+        index = easygdf.build_index(f)
+        serial = [easygdf.read_block(f, block, keys=['x', 'ID']) for block in index]
+        threaded = easygdf.map_blocks(f, index, lambda block, arrays: arrays, keys=['x', 'ID'], max_workers=8)
+
+    assert_same_dicts(threaded, serial)
@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pytest
+
+from pmd_beamphysics import ParticleGroup
+
+from gpt import particles
+from gpt import tools
+from gpt import easygdf
+from gpt.parsers import read_particle_gdf_file
+from gpt.particles import ParticleHistory, particle_history_stats, gdf_to_particle_groups, centroid_coordinates_history
+from gpt.particles import particle_group_view, write_particle_group_gdf
+
+from conftest import write_gpt_gdf
+
+
+KEYS = ['mean_x', 'sigma_x', 'min_y', 'max_pz', 'ptp_t', 'mean_energy', 'sigma_gamma', 'mean_kinetic_energy',
+        'mean_beta', 'sigma_beta_z', 'mean_r', 'sigma_pr', 'mean_ptheta', 'sigma_xp', 'mean_yp',
+        'cov_x__px', 'cov_y__py', 'cov_x__y', 'norm_emit_x', 'norm_emit_y', 'norm_emit_4d',
+        'n_particle', 'n_alive', 'charge', 'higher_order_energy_spread']
+
+
+@pytest.mark.parametrize('data_type', ['tout', 'screen'])
+def test_particle_history_stats(gpt_gdf, data_type):
+    touts, screens, _ = gdf_to_particle_groups(gpt_gdf)
+    groups = touts if(data_type=='tout') else screens
+
+    stats = particle_history_stats(ParticleHistory.from_particle_groups(groups), KEYS)
+
+    for key in KEYS:
+        assert np.allclose(stats[key], [pg[key] for pg in groups], rtol=1e-9, atol=0), key
+
+
+def test_particle_history_stats_empty():
+    stats = particle_history_stats(ParticleHistory.from_particle_groups([]), KEYS)
+
+    for key in KEYS:
+        assert len(stats[key])==0, key
+
+
+def test_centroid_coordinates_history(gpt_gdf):
+    touts, _, _ = gdf_to_particle_groups(gpt_gdf)
+    touts.insert(2, touts[0][0:0])  # An empty group
+
+    ccs = centroid_coordinates_history(ParticleHistory.from_particle_groups(touts))
+
+    assert len(ccs) == len(touts)
+    for pg, ref in zip(ccs, touts):
+        if(ref.n_particle==0):
+            assert pg.n_particle == 0
+            continue
+        ref = tools.transform_to_centroid_coordinates(ref)
+        for key in ['x', 'y', 'z', 'px', 'py', 'pz', 't', 'weight', 'id']:
+            assert np.allclose(pg[key], ref[key], rtol=1e-12, atol=1e-15), key
+
+
+@pytest.mark.parametrize('n', [0, 1, 5])
+def test_particle_group_view_shares_memory(n):
+    rng = np.random.default_rng(n)
+    data = {key:rng.normal(size=n) for key in ['x', 'px', 'y', 'py', 'z', 'pz', 't']}
+    data['pz'] += 1e6
+    data['weight'] = rng.uniform(1, 2, n)
+    data['status'] = np.ones(n, dtype=int)
+    data['id'] = np.arange(1, n+1)
+    data['species'] = 'electron'
+
+    pg = particle_group_view(data)
+    ref = ParticleGroup(data={key:np.copy(value) if(key!='species') else value for key, value in data.items()})
+
+    assert pg.species == 'electron' and pg.n_particle == n
+    for key in ['x', 'px', 'y', 'py', 'z', 'pz', 't', 'weight', 'status', 'id']:
+        assert getattr(pg, key) is data[key], key
+        assert np.array_equal(pg[key], ref[key]), key
+
+    if(n>1):
+        assert np.isclose(pg['norm_emit_x'], ref['norm_emit_x'], rtol=1e-12)
+
+    pg.x += 1
+    assert np.array_equal(data['x'], ref.x + 1)
+
+
+def assert_same_groups(groups, reference):
+    assert len(groups) == len(reference)
+    for pg, ref in zip(groups, reference):
+        for key in ['x', 'px', 'y', 'py', 'z', 'pz', 't', 'weight', 'status', 'id']:
+            assert np.array_equal(getattr(pg, key), getattr(ref, key)), key
+        assert pg.species == ref.species
+
+
+def test_particle_cache_reused(gpt_gdf, monkeypatch):
+    touts, screens, _ = gdf_to_particle_groups(gpt_gdf, use_cache=True)
+    assert os.path.exists(particles.particle_cache_file(gpt_gdf))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the gdf file was read again')
+    monkeypatch.setattr(particles, 'read_gdf_file', fail)
+
+    cached_touts, cached_screens, fields = gdf_to_particle_groups(gpt_gdf, use_cache=True)
+
+    assert isinstance(cached_touts[0].x, np.memmap)
+    assert fields == [None]*len(touts)
+    assert_same_groups(cached_touts, touts)
+    assert_same_groups(cached_screens, screens)
+
+
+def test_particle_cache_rebuilt(gpt_gdf, monkeypatch):
+    gdf_to_particle_groups(gpt_gdf, use_cache=True)
+    assert particles.read_particle_cache(gpt_gdf) is not None
+
+    # Other columns
+    assert particles.read_particle_cache(gpt_gdf, columns=['rxy']) is None
+
+    # Newer layout version
+    with monkeypatch.context() as m:
+        m.setattr(particles, 'PARTICLE_CACHE_VERSION', particles.PARTICLE_CACHE_VERSION+1)
+        assert particles.read_particle_cache(gpt_gdf) is None
+
+    # Same size, touched
+    stat = os.stat(gpt_gdf)
+    os.utime(gpt_gdf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert particles.read_particle_cache(gpt_gdf) is None
+
+    # Rewritten with other particles
+    write_gpt_gdf(gpt_gdf, n_particle=40, seed=1)
+    assert particles.read_particle_cache(gpt_gdf) is None
+
+    touts, screens, _ = gdf_to_particle_groups(gpt_gdf, use_cache=True)
+    reference_touts, reference_screens, _ = gdf_to_particle_groups(gpt_gdf)
+    assert_same_groups(touts, reference_touts)
+    assert_same_groups(screens, reference_screens)
+
+    cached_touts, _ = particles.read_particle_cache(gpt_gdf)
+    assert_same_groups(cached_touts, reference_touts)
+
+
+def test_particle_cache_copy_on_write(gpt_gdf):
+    touts, _, _ = gdf_to_particle_groups(gpt_gdf, use_cache=True)
+    cache_file = particles.particle_cache_file(gpt_gdf)
+    with open(cache_file, 'rb') as f:
+        contents = f.read()
+
+    cached_touts, _ = particles.read_particle_cache(gpt_gdf)
+    cached_touts[0].x[:] = 0
+    cached_touts[0].x.flush()
+    del cached_touts
+
+    with open(cache_file, 'rb') as f:
+        assert f.read() == contents
+
+    cached_touts, _ = particles.read_particle_cache(gpt_gdf)
+    assert_same_groups(cached_touts, touts)
+
+
+@pytest.mark.parametrize('with_id', [False, True])
+def test_write_particle_group_gdf_round_trip(tmp_path, with_id):
+    n = 40
+    rng = np.random.default_rng(7)
+    data = {key:rng.normal(size=n)*1e-3 for key in ['x', 'y', 'z']}
+    data.update({key:rng.normal(size=n)*1e3 for key in ['px', 'py']})
+    data['pz'] = 5e6 + rng.normal(size=n)*1e4
+    data['t'] = rng.normal(size=n)*1e-12
+    data['weight'] = rng.uniform(1e-15, 3e-15, n)
+    data['status'] = np.ones(n, dtype=int)
+    data['species'] = 'electron'
+    if(with_id):
+        data['id'] = rng.permutation(n) + 100
+    pg = ParticleGroup(data=data)
+
+    gdffile = str(tmp_path/'particles.gdf')
+    write_particle_group_gdf(pg, gdffile)
+
+    with open(gdffile, 'rb') as f:
+        arrays = easygdf.load_arrays(f)
+
+    assert list(arrays) == ['x', 'y', 'z', 'GBx', 'GBy', 'GBz', 't', 'q', 'm', 'nmacro', 'ID']
+    for key in ['x', 'y', 'z', 't']:
+        assert np.array_equal(arrays[key], pg[key]), key
+    for key in ['x', 'y', 'z']:
+        assert np.allclose(arrays['GB'+key]*pg.mass, pg['p'+key], rtol=1e-12, atol=0), key
+    assert np.allclose(np.abs(arrays['q']*arrays['nmacro']), pg.weight, rtol=1e-12, atol=0)
+    assert np.array_equal(arrays['ID'], pg.id if(with_id) else np.arange(1, n+1))
+
+    screen = read_particle_gdf_file(gdffile)
+    assert screen['n'] == n
+    for key in ['x', 'y', 'z', 't']:
+        assert np.array_equal(screen[key], pg[key]), key
+    assert np.array_equal(screen['GBz'], arrays['GBz'])
+    assert np.allclose(screen['w'], pg.weight/np.sum(pg.weight), rtol=1e-12, atol=0)
+    assert np.isclose(np.sum(np.abs(screen['q']*screen['nmacro'])), pg.charge, rtol=1e-12)
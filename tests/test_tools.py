@@ -0,0 +1,92 @@
+import asyncio
+import sys
+import threading
+import time
+
+import pytest
+
+from gpt import tools
+
+
+CMD = [sys.executable, '-c', 'import sys, time; sys.stderr.write("running\\n"); sys.stderr.flush(); time.sleep(0.5)']
+
+
+class FailingMonitor:
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, done):
+        self.calls.append(done)
+        raise RuntimeError('bad on_output')
+
+
+def run(cmd, monitor, use_async, workdir, monitor_interval=0.05):
+    kwargs = dict(timeout=10, monitor=monitor, monitor_interval=monitor_interval, workdir=workdir)
+    if(use_async):
+        return asyncio.run(tools.execute_async(cmd, **kwargs))
+    return tools.execute(cmd, **kwargs)
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_monitor_exception_is_reported(tmp_path, use_async):
+    monitor = FailingMonitor()
+
+    run_time, exception, log = run(CMD, monitor, use_async, str(tmp_path))
+
+    assert monitor.calls == [False]
+    assert 'bad on_output' in exception
+    assert log == ['running\n']
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+@pytest.mark.parametrize('interval', [0.05, 10])
+def test_monitor_exception_when_done(tmp_path, use_async, interval):
+    calls = []
+
+    def monitor(done):
+        calls.append(done)
+        if(done):
+            raise RuntimeError('bad on_output')
+
+    run_time, exception, log = run(CMD, monitor, use_async, str(tmp_path), monitor_interval=interval)
+
+    assert calls[-1] is True
+    assert exception.startswith('Output monitor failed:') and 'bad on_output' in exception
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_monitor_called_until_done(tmp_path, use_async):
+    calls = []
+
+    run_time, exception, log = run(CMD, calls.append, use_async, str(tmp_path))
+
+    assert exception is None
+    assert calls[-1] is True and len(calls) > 2 and not any(calls[:-1])
+
+
+def test_execute_async_monitor_off_the_loop(tmp_path):
+    calls = []
+    running = []
+
+    def monitor(done):
+        running.append(done)
+        assert len(running) == 1  # Calls never overlap
+        calls.append((done, threading.get_ident()))
+        time.sleep(0.1)
+        running.pop()
+
+    async def main():
+        ticks = 0
+        job = asyncio.ensure_future(tools.execute_async(CMD, timeout=10, monitor=monitor, monitor_interval=0.05, workdir=str(tmp_path)))
+        while not job.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks, job.result()
+
+    ticks, (run_time, exception, log) = asyncio.run(main())
+
+    assert exception is None
+    assert calls[-1][0] is True
+    assert threading.get_ident() not in [ident for _, ident in calls]
+    assert ticks > 20  # The loop kept running while the monitor slept